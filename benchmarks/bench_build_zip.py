@@ -0,0 +1,56 @@
+"""Compare le temps de construction du ZIP annuel selon la compression et le nombre de threads.
+
+Usage :
+    python benchmarks/bench_build_zip.py [nombre_de_collaborateurs]
+
+Les pages sont des 2èmes pages de bulletins synthétiques (voir
+bench_extract_second_page.py), 12 par collaborateur.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import payslip_pdf  # noqa: E402
+from payslip_archive import (  # noqa: E402
+    CompressionPolicy, build_zip, create_archive_pool, COMPRESSION_AUTO, COMPRESSION_DEFLATE, COMPRESSION_STORED
+)
+from bench_extract_second_page import make_synthetic_payslip  # noqa: E402
+
+POLICIES = [
+    CompressionPolicy(COMPRESSION_STORED),
+    CompressionPolicy(COMPRESSION_AUTO),
+    CompressionPolicy(COMPRESSION_DEFLATE, 1),
+    CompressionPolicy(COMPRESSION_DEFLATE, 6),
+    CompressionPolicy(COMPRESSION_DEFLATE, 9),
+]
+
+def make_entries(collaborators):
+    pages = [payslip_pdf.extract_second_page(make_synthetic_payslip(2, seed))["content"] for seed in range(12)]
+    return [
+        (f"Collaborateur_{c}/Collaborateur_{c}_2024_{month + 1:02d}.pdf", pages[month])
+        for c in range(collaborators) for month in range(12)
+    ]
+
+def main():
+    collaborators = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    entries = make_entries(collaborators)
+    input_bytes = sum(len(content) for _, content in entries)
+    print(f"{len(entries)} fichiers, {input_bytes / 1e6:.1f} Mo, {os.cpu_count()} cœur(s)")
+
+    worker_counts = sorted({1, os.cpu_count() or 1})
+    pools = {workers: create_archive_pool(workers) for workers in worker_counts}
+    print(f"{'Compression':<22} " + " ".join(f"{f'{w} thread(s) (s)':>16}" for w in worker_counts) + f" {'Taille (Mo)':>12}")
+    for policy in POLICIES:
+        timings = []
+        for workers in worker_counts:
+            start = time.perf_counter()
+            content, _ = build_zip(entries, policy, pools[workers])
+            timings.append(time.perf_counter() - start)
+        print(f"{str(policy):<22} " + " ".join(f"{t:>16.3f}" for t in timings) + f" {len(content) / 1e6:>12.2f}")
+    for pool in pools.values():
+        pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Mesure les récupérations mensuelle et annuelle de bout en bout contre le faux serveur Payfit.
+
+Usage :
+    python benchmarks/bench_end_to_end.py [--sizes 10 500 5000] [--modes monthly yearly] [--latency 0.02]
+
+Pour chaque taille d'entreprise, mock_payfit_server.py est lancé dans un
+processus à part ; chaque récupération (run_monthly ou run_yearly, comme
+l'application) tourne ensuite dans son propre processus pour que le pic de
+mémoire mesuré soit le sien. Le débit du client est plafonné à --max-rate
+requêtes par seconde (1000 par défaut, au lieu de 100 contre l'API réelle)
+pour mesurer le pipeline plutôt que le planificateur. Le tableau donne le
+temps total, les requêtes par seconde vues par le serveur et le pic RSS du
+processus (et de ses processus d'extraction) ; --json écrit les mesures,
+avec le détail par étape de chaque récupération (run_metrics).
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, ".."))
+
+DEFAULT_SIZES = (10, 500, 5000)
+DEFAULT_MODES = ("monthly", "yearly")
+DEFAULT_YEAR = 2024
+DEFAULT_MAX_RATE = 1000
+
+def peak_rss_mb(who):
+    """Pic de mémoire résidente en Mo (ru_maxrss est en Ko sous Linux, en octets sous macOS)"""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_child(mode, year, max_workers, streaming):
+    """Exécute une récupération dans ce processus et renvoie ses mesures"""
+    from job_engine import Job
+    from payslip_cli import create_context
+    from payslip_pipeline import run_monthly, run_yearly
+
+    context = create_context()
+    task = Job(mode)
+    start = time.perf_counter()
+    try:
+        if mode == "monthly":
+            result = run_monthly(task, "benchmark", context, str(year), "06", max_workers)
+            payslips = len(result["payslip_data"])
+        else:
+            result = run_yearly(task, "benchmark", context, year, max_workers, streaming_zip=streaming)
+            payslips = result["yearly_stats"]["total_payslips_found"]
+            if result["archive"] is not None:
+                result["archive"].close()
+        wall = time.perf_counter() - start
+        stages = result["metrics"].to_dict()["stages"]
+    finally:
+        for pool in (context.extraction_pool, context.archive_pool):
+            if pool is not None:
+                pool.shutdown()
+    return {
+        "wall_seconds": wall,
+        "payslips": payslips,
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+def server_request(url, path, method="GET"):
+    with urllib.request.urlopen(urllib.request.Request(f"{url}{path}", method=method, data=b"" if method == "POST" else None)) as response:
+        return json.loads(response.read())
+
+def start_server(args, collaborators):
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, "mock_payfit_server.py"),
+               "--collaborators", str(collaborators), "--years", str(args.year - 1), str(args.year),
+               "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+               "--throttle-rate", str(args.throttle_rate), "--port", "0"]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+def run_scenario(args, url, mode):
+    env = dict(os.environ, PAYFIT_API_URL=url, PAYFIT_OAUTH_URL=url, PAYFIT_MAX_RATE=str(args.max_rate),
+               PAYFIT_RATE=str(args.max_rate))
+    env.pop("PAYSLIP_CACHE_DIR", None)  # Pas de cache disque : tout est téléchargé
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--year", str(args.year),
+               "--max-workers", str(args.max_workers)]
+    if args.streaming:
+        command.append("--streaming")
+    server_request(url, "/_reset", "POST")
+    output = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+    measures = json.loads(output.strip().splitlines()[-1])
+    stats = server_request(url, "/_stats")
+    measures["requests"] = stats["requests"]
+    measures["requests_per_second"] = stats["requests"] / measures["wall_seconds"]
+    measures["server_errors"] = stats["errors"] + stats["throttled"]
+    measures["bytes_received"] = stats["bytes_sent"]
+    return measures
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de bout en bout contre le faux serveur Payfit")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="nombres de collaborateurs")
+    parser.add_argument("--modes", nargs="+", choices=DEFAULT_MODES, default=list(DEFAULT_MODES))
+    parser.add_argument("--year", type=int, default=DEFAULT_YEAR)
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--max-rate", type=float, default=DEFAULT_MAX_RATE, help="requêtes par seconde au plus")
+    parser.add_argument("--streaming", action="store_true", help="archive annuelle sur disque")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="fichier où écrire les mesures")
+    parser.add_argument("--child", choices=DEFAULT_MODES, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(run_child(args.child, args.year, args.max_workers, args.streaming)))
+        return
+
+    results = []
+    print(f"{'Mode':<8} {'Collab.':>8} {'Bulletins':>10} {'Temps (s)':>10} {'Requêtes':>9} {'Req/s':>8} "
+          f"{'Erreurs':>8} {'RSS max (Mo)':>13} {'RSS extraction (Mo)':>20}")
+    for size in args.sizes:
+        server, url = start_server(args, size)
+        try:
+            for mode in args.modes:
+                measures = run_scenario(args, url, mode)
+                measures.update(mode=mode, collaborators=size)
+                results.append(measures)
+                print(f"{mode:<8} {size:>8} {measures['payslips']:>10} {measures['wall_seconds']:>10.2f} "
+                      f"{measures['requests']:>9} {measures['requests_per_second']:>8.1f} "
+                      f"{measures['server_errors']:>8} {measures['peak_rss_mb']:>13.1f} "
+                      f"{measures['peak_rss_children_mb']:>20.1f}", flush=True)
+        finally:
+            server.terminate()
+            server.wait()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Compare les moteurs d'extraction de la 2ème page ("full" et "lazy").
+
+Usage :
+    python benchmarks/bench_extract_second_page.py [dossier_de_bulletins_pdf]
+
+Sans dossier, des bulletins synthétiques de taille réaliste sont générés
+(polices TrueType embarquées, logo, ~900 lignes de texte par page).
+"""
+import io
+import os
+import random
+import sys
+import timeit
+
+import PyPDF2
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject, StreamObject
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import payslip_pdf  # noqa: E402
+
+def make_synthetic_payslip(pages=2, seed=0):
+    """Génère un bulletin synthétique d'environ 130 Ko pour 2 pages"""
+    rnd = random.Random(seed)
+    writer = PyPDF2.PdfWriter()
+
+    fonts = DictionaryObject()
+    for i in range(3):
+        font_file = StreamObject()
+        font_file._data = rnd.randbytes(30000)
+        font_file[NameObject("/Length1")] = NumberObject(30000)
+        descriptor = DictionaryObject({
+            NameObject("/Type"): NameObject("/FontDescriptor"),
+            NameObject("/FontName"): NameObject(f"/F{i}"),
+            NameObject("/FontFile2"): writer._add_object(font_file)
+        })
+        fonts[NameObject(f"/F{i}")] = writer._add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/TrueType"),
+            NameObject("/BaseFont"): NameObject(f"/AAAAAA+Font{i}"),
+            NameObject("/FontDescriptor"): writer._add_object(descriptor)
+        }))
+
+    logo = StreamObject()
+    logo._data = rnd.randbytes(25000)
+    logo.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(100),
+        NameObject("/Height"): NumberObject(83),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8)
+    })
+    logo_ref = writer._add_object(logo)
+
+    for _ in range(pages):
+        page = PyPDF2.PageObject.create_blank_page(None, 595, 842)
+        lines = [
+            f"BT /F{l % 3} 8 Tf {40 + l % 5 * 100} {800 - l % 90 * 9} Td "
+            f"(Ligne {l} salaire brut {rnd.randint(0, 99999) / 100:.2f} EUR) Tj ET"
+            for l in range(900)
+        ]
+        content = DecodedStreamObject()
+        content.set_data("\n".join(lines).encode())
+        page[NameObject("/Contents")] = writer._add_object(content.flate_encode())
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): fonts,
+            NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): logo_ref})
+        })
+        writer.add_page(page)
+
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def load_samples(directory=None):
+    if directory:
+        samples = []
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(".pdf"):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    samples.append((name, f.read()))
+        return samples
+    return [(f"synthétique {pages} pages", make_synthetic_payslip(pages)) for pages in (2, 3, 12)]
+
+def check_same_text(pdf_content):
+    """Vérifie que les deux moteurs produisent une page au texte identique"""
+    pages = []
+    for engine in (payslip_pdf.ENGINE_FULL, payslip_pdf.ENGINE_LAZY):
+        content = payslip_pdf.extract_second_page(pdf_content, engine)["content"]
+        pages.append(PyPDF2.PdfReader(io.BytesIO(content)).pages[0].extract_text() if content else None)
+    return pages[0] == pages[1]
+
+def main():
+    samples = load_samples(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"{'Bulletin':<28} {'Taille':>9} {'full (ms)':>10} {'lazy (ms)':>10} {'Gain':>6}  Identique")
+    for name, pdf_content in samples:
+        timings = {}
+        for engine in (payslip_pdf.ENGINE_FULL, payslip_pdf.ENGINE_LAZY):
+            timer = timeit.Timer(lambda: payslip_pdf.extract_second_page(pdf_content, engine))
+            number, _ = timer.autorange()
+            timings[engine] = min(timer.repeat(repeat=5, number=number)) / number * 1000
+        gain = timings[payslip_pdf.ENGINE_FULL] / timings[payslip_pdf.ENGINE_LAZY]
+        print(f"{name[:28]:<28} {len(pdf_content):>9} {timings[payslip_pdf.ENGINE_FULL]:>10.2f} "
+              f"{timings[payslip_pdf.ENGINE_LAZY]:>10.2f} {gain:>5.1f}x  {'oui' if check_same_text(pdf_content) else 'NON'}")
+
+if __name__ == "__main__":
+    main()
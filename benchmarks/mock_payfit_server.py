@@ -0,0 +1,237 @@
+"""Faux serveur de l'API partenaire Payfit, pour mesurer les récupérations sans entreprise réelle.
+
+Usage :
+    python benchmarks/mock_payfit_server.py [--collaborators 500] [--port 8765] [--latency 0.02]
+
+puis, par exemple :
+    PAYFIT_API_URL=http://127.0.0.1:8765 PAYFIT_OAUTH_URL=http://127.0.0.1:8765 streamlit run index.py
+
+Points d'accès simulés : introspection, entreprise, collaborateurs (paginés,
+avec ETag), listes de bulletins et PDF (bulletins synthétiques de
+bench_extract_second_page.py). Chaque réponse attend `latency` secondes
+(± 50 %) ; une fraction error_rate des réponses est une erreur 503 et une
+fraction throttle_rate un 429 avec Retry-After. Un collaborateur sur dix
+n'a aucun bulletin. GET /_stats et POST /_reset servent aux benchmarks.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_extract_second_page import make_synthetic_payslip  # noqa: E402
+
+COMPANY_ID = "mock-company"
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_YEARS = (2023, 2024)
+# Bulletins PDF différents servis, choisis selon l'identifiant du bulletin
+PDF_VARIANTS = 12
+
+COLLABORATORS_PATH = re.compile(rf"/companies/{COMPANY_ID}/collaborators")
+LISTING_PATH = re.compile(rf"/companies/{COMPANY_ID}/collaborators/(collab-\d+)/payslips/?")
+PDF_PATH = re.compile(rf"/companies/{COMPANY_ID}/collaborators/(collab-\d+)/contracts/([\w-]+)/payslips/([\w-]+)")
+
+class MockPayfit:
+    """Données et comportement du faux serveur : taille de l'entreprise, latence, erreurs"""
+
+    def __init__(self, collaborators=500, years=DEFAULT_YEARS, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                 page_size=DEFAULT_PAGE_SIZE, seed=0):
+        self.collaborators = [
+            {"id": f"collab-{i}", "firstName": f"Prenom{i}", "lastName": f"Nom{i}",
+             "email": f"prenom{i}.nom{i}@example.com", "status": "active"}
+            for i in range(collaborators)
+        ]
+        self.years = tuple(years)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.page_size = page_size
+        self.pdfs = [make_synthetic_payslip(2, seed + variant) for variant in range(PDF_VARIANTS)]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {"requests": 0, "errors": 0, "throttled": 0, "bytes_sent": 0, "by_endpoint": {}}
+
+    def stats_json(self):
+        with self._lock:
+            return json.dumps(self.stats).encode()
+
+    def count(self, endpoint, status, size):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_sent"] += size
+            self.stats["by_endpoint"][endpoint] = self.stats["by_endpoint"].get(endpoint, 0) + 1
+            if status == 503:
+                self.stats["errors"] += 1
+            elif status == 429:
+                self.stats["throttled"] += 1
+
+    def draw(self):
+        """Latence puis éventuelle erreur simulée : renvoie None, 503 ou 429"""
+        with self._lock:
+            delay = self.latency * (0.5 + self._random.random())
+            roll = self._random.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.error_rate:
+            return 503
+        if roll < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+    def payslips(self, index):
+        if index % 10 == 9:
+            return []
+        return [
+            {"year": year, "month": month, "contractId": f"contract-{index}",
+             "payslipId": f"payslip-{index}-{year}-{month:02d}"}
+            for year in self.years for month in range(1, 13)
+        ]
+
+    def pdf(self, payslip_id):
+        digest = hashlib.sha256(payslip_id.encode()).digest()
+        return self.pdfs[digest[0] % len(self.pdfs)]
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Connexions keep-alive, comme l'API réelle
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, endpoint, status, body=b"", content_type="application/json", headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            mock.count(endpoint, status, len(body))
+
+        def send_json(self, endpoint, data, headers=None):
+            self.send(endpoint, 200, json.dumps(data).encode(), headers=headers)
+
+        def simulated_failure(self, endpoint):
+            status = mock.draw()
+            if status == 429:
+                self.send(endpoint, 429, b"{}", headers={"Retry-After": "1"})
+            elif status:
+                self.send(endpoint, status, b"{}")
+            return status is not None
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            if url.path == "/_reset":
+                mock.reset()
+                return self.send("_reset", 200, b"{}")
+            if url.path != "/introspect":
+                return self.send("unknown", 404, b"{}")
+            if self.simulated_failure("introspect"):
+                return
+            token = json.loads(body or b"{}").get("token")
+            self.send_json("introspect", {
+                "active": bool(token) and token != "invalid",
+                "company_id": COMPANY_ID,
+                "exp": time.time() + 3600
+            })
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            path = url.path
+            if path == "/_stats":
+                return self.send("_stats", 200, mock.stats_json())
+            if path == f"/companies/{COMPANY_ID}":
+                if self.simulated_failure("company"):
+                    return
+                return self.send_json("company", {"id": COMPANY_ID, "name": "Entreprise simulée",
+                                                  "nbActiveContracts": len(mock.collaborators)})
+            if COLLABORATORS_PATH.fullmatch(path):
+                if self.simulated_failure("collaborators"):
+                    return
+                start = int(parse_qs(url.query).get("nextPageToken", ["0"])[0])
+                page = mock.collaborators[start:start + mock.page_size]
+                etag = f'"{COMPANY_ID}-{start}-{len(mock.collaborators)}"'
+                if self.headers.get("If-None-Match") == etag:
+                    return self.send("collaborators", 304)
+                meta = {}
+                if start + mock.page_size < len(mock.collaborators):
+                    meta["nextPageToken"] = str(start + mock.page_size)
+                return self.send_json("collaborators", {"collaborators": page, "meta": meta}, {"ETag": etag})
+            if match := LISTING_PATH.fullmatch(path):
+                if self.simulated_failure("payslips"):
+                    return
+                index = int(match.group(1).split("-")[1])
+                if index >= len(mock.collaborators):
+                    return self.send("payslips", 404, b"{}")
+                return self.send_json("payslips", {"payslips": mock.payslips(index)})
+            if match := PDF_PATH.fullmatch(path):
+                if self.simulated_failure("pdf"):
+                    return
+                return self.send("pdf", 200, mock.pdf(match.group(3)), "application/pdf")
+            self.send("unknown", 404, b"{}")
+
+    return Handler
+
+class MockPayfitServer:
+    """Faux serveur lancé dans un thread ; url est à passer dans PAYFIT_API_URL et PAYFIT_OAUTH_URL"""
+
+    def __init__(self, mock, host="127.0.0.1", port=0):
+        self.mock = mock
+        self._server = ThreadingHTTPServer((host, port), make_handler(mock))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-payfit", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Faux serveur de l'API partenaire Payfit")
+    parser.add_argument("--collaborators", type=int, default=500)
+    parser.add_argument("--years", type=int, nargs="+", default=list(DEFAULT_YEARS))
+    parser.add_argument("--latency", type=float, default=0.0, help="latence moyenne par réponse, en secondes")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction de réponses 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction de réponses 429")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="0 pour un port libre")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    mock = MockPayfit(args.collaborators, args.years, args.latency, args.error_rate, args.throttle_rate,
+                      args.page_size)
+    server = MockPayfitServer(mock, args.host, args.port).start()
+    # Première ligne lue par bench_end_to_end.py
+    print(server.url, flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,25 @@
 import streamlit as st
-import requests
-import json
 import os
 import base64
 from datetime import datetime
 import pandas as pd
-import PyPDF2  # Bibliothèque pour manipuler les PDF
-import io  # Pour manipuler les fichiers en mémoire
-import time  # Pour ajouter des délais si nécessaire
-import zipfile  # Pour créer des archives ZIP
-import gc  # Pour le garbage collector
-import sys  # Pour accéder aux références d'objets
+import hmac
+import uuid
+from payfit_api import (
+    IntrospectionCache, RosterCache, PayslipIndex,
+    DEFAULT_MAX_WORKERS, DEFAULT_ROSTER_TTL, DEFAULT_PAYSLIP_INDEX_TTL
+)
+from payslip_cache import cache_from_env
+from payslip_archive import (
+    build_zip, create_archive_pool, compression_policy_from_env,
+    COMPRESSION_MODES, COMPRESSION_AUTO, COMPRESSION_STORED, COMPRESSION_DEFLATE
+)
+from job_engine import JobEngine, JobError, JOB_DONE, JOB_CANCELLED, DEFAULT_JOB_WORKERS
+from payslip_pipeline import PipelineContext, record_exported, run_monthly, run_profiled, run_range
+from result_store import store_from_env, ResultQuotaExceeded
+from secret_handle import SecretHandle
+from sync_manifest import manifest_from_env
+import payslip_pdf
 
 st.set_page_config(
     page_title="Payfit - Récupération des bulletins de paie",
@@ -27,255 +36,481 @@ def get_binary_file_downloader_html(bin_file, file_label):
     href = f'<a href="data:application/pdf;base64,{b64}" download="{os.path.basename(bin_file)}">Télécharger {file_label}</a>'
     return href
 
-def create_zip_in_memory(payslip_data):
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for name, data in payslip_data.items():
-            zipf.writestr(data["file_name"], data["content"])
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+# Libellés des politiques de compression dans l'interface
+COMPRESSION_LABELS = {
+    COMPRESSION_AUTO: "Automatique (selon un échantillon)",
+    COMPRESSION_STORED: "Aucune (le plus rapide)",
+    COMPRESSION_DEFLATE: "Deflate",
+}
 
-def extract_second_page(pdf_content):
-    try:
-        input_pdf = io.BytesIO(pdf_content)
-        pdf_reader = PyPDF2.PdfReader(input_pdf)
-        
-        if len(pdf_reader.pages) < 2:
-            st.warning("Le fichier n'a qu'une seule page.")
-            return None
-        
-        pdf_writer = PyPDF2.PdfWriter()
-        pdf_writer.add_page(pdf_reader.pages[1])
-        
-        output_pdf = io.BytesIO()
-        pdf_writer.write(output_pdf)
-        output_pdf.seek(0)
-        
-        return output_pdf.getvalue()
-    except Exception as e:
-        st.error(f"Erreur lors de l'extraction de la 2ème page: {str(e)}")
+def format_archive_stats(stats, policy):
+    """Résumé du temps de construction d'une archive, pour comparer les politiques de compression"""
+    return (
+        f"🗜️ Archive construite en {stats['build_seconds']:.2f} s, compression {policy} : "
+        f"{stats['deflated']} fichier(s) compressé(s), {stats['stored']} stocké(s), "
+        f"{stats['input_bytes'] / 1e6:.1f} Mo → {stats['output_bytes'] / 1e6:.1f} Mo"
+    )
+
+# Libellés des étapes mesurées (run_metrics) dans l'interface
+STAGE_LABELS = {
+    "introspect": "Vérification de la clé",
+    "company": "Entreprise",
+    "roster": "Liste des collaborateurs",
+    "listings": "Listes de bulletins",
+    "cache": "Cache disque",
+    "download": "Téléchargement des PDF",
+    "extraction": "Extraction de la 2ème page",
+    "archive": "Construction du ZIP",
+}
+
+def display_run_metrics(metrics, key, **labels):
+    """Temps, octets, nouvelles tentatives et erreurs de chaque étape, avec export JSON et Prometheus"""
+    if metrics is None:
+        return
+    data = metrics.to_dict()
+    with st.expander("⏱️ Détail par étape", expanded=False):
+        rows = []
+        for stage, stats in data["stages"].items():
+            rows.append({
+                "Étape": STAGE_LABELS.get(stage, stage),
+                "Opérations": stats["count"],
+                "Temps cumulé (s)": round(stats["seconds"], 2),
+                "Moyenne (ms)": round(1000 * stats["seconds"] / stats["count"], 1) if stats["count"] else None,
+                "p95 (ms)": round(1000 * stats["p95_seconds"], 1) if stats["p95_seconds"] is not None else None,
+                "Max (ms)": round(1000 * stats["max_seconds"], 1),
+                "Mo": round(stats["bytes"] / 1e6, 2),
+                "Nouvelles tentatives": stats["retries"],
+                "Erreurs": stats["errors"],
+            })
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        st.caption(
+            f"Durée totale : {data['wall_seconds']:.2f} s. Les étapes se chevauchent et les requêtes partent "
+            "en parallèle : le temps cumulé d'une étape peut dépasser la durée totale."
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                label="📥 Mesures (JSON)", data=metrics.to_json(**labels),
+                file_name=f"mesures_{key}.json", mime="application/json", key=f"{key}_metrics_json"
+            )
+        with col2:
+            st.download_button(
+                label="📥 Mesures (Prometheus)", data=metrics.to_prometheus(**labels),
+                file_name=f"mesures_{key}.prom", mime="text/plain", key=f"{key}_metrics_prom"
+            )
+
+def display_run_profile(profile):
+    """Profil d'une récupération lancée avec le profilage : fonctions les plus coûteuses et allocations"""
+    if profile is None:
+        return
+    with st.expander("🩺 Profil de la récupération", expanded=False):
+        st.caption(
+            ", ".join(f"{key} : {value}" for key, value in profile.tags.items())
+            + f" — {profile.seconds:.2f} s profilées, pic tracemalloc {profile.peak_bytes / 1e6:.1f} Mo"
+        )
+        st.code(profile.functions_text, language=None)
+        st.code(profile.allocations_text, language=None)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                label="📥 Profil cProfile (.prof)", data=profile.profile_data,
+                file_name=f"{profile.file_stem}.prof", mime="application/octet-stream",
+                key=f"{profile.file_stem}_prof", help="À ouvrir avec pstats ou snakeviz"
+            )
+        with col2:
+            st.download_button(
+                label="📥 Rapport (.txt)", data=profile.text(),
+                file_name=f"{profile.file_stem}.txt", mime="text/plain", key=f"{profile.file_stem}_txt"
+            )
+
+def is_profiling_admin():
+    """Le profilage est réservé à l'administration : l'URL doit contenir ?admin=<PROFILING_ADMIN_TOKEN>"""
+    token = os.environ.get("PROFILING_ADMIN_TOKEN")
+    if not token:
+        return False
+    return hmac.compare_digest(st.query_params.get("admin", "").encode(), token.encode())
+
+def profiling_checkbox(key):
+    """Case du profilage, affichée seulement pour l'administration"""
+    if not is_profiling_admin():
+        return False
+    return st.checkbox(
+        "🩺 Profiler la récupération (cProfile + tracemalloc)",
+        help="Ralentit la récupération ; un seul profilage à la fois sur le serveur",
+        key=key
+    )
+
+@st.cache_resource
+def get_extraction_pool():
+    """Pool de processus pour l'extraction des pages (None si PDF_EXTRACTION_WORKERS=0)"""
+    workers = os.environ.get("PDF_EXTRACTION_WORKERS")
+    if workers == "0":
         return None
+    return payslip_pdf.create_extraction_pool(int(workers) if workers else None)
+
+@st.cache_resource
+def get_archive_pool():
+    """Pool de threads pour compresser les fichiers des ZIP (None si ARCHIVE_WORKERS=0)"""
+    workers = os.environ.get("ARCHIVE_WORKERS")
+    if workers == "0":
+        return None
+    return create_archive_pool(int(workers) if workers else None)
+
+@st.cache_resource
+def get_roster_cache():
+    """Listes de collaborateurs par entreprise, partagées par toutes les sessions"""
+    return RosterCache(ttl=int(os.environ.get("ROSTER_TTL_SECONDS") or DEFAULT_ROSTER_TTL))
+
+@st.cache_resource
+def get_payslip_index():
+    """Index des bulletins par (collaborateur, année, mois), partagé par toutes les sessions"""
+    return PayslipIndex(ttl=int(os.environ.get("PAYSLIP_INDEX_TTL_SECONDS") or DEFAULT_PAYSLIP_INDEX_TTL))
+
+@st.cache_resource
+def get_payslip_cache():
+    """Cache disque des bulletins, partagé par toutes les sessions (None si non configuré)"""
+    return cache_from_env()
+
+@st.cache_resource
+def get_job_engine():
+    """Tâches de récupération en arrière-plan, partagées par toutes les sessions.
+
+    Une tâche terminée est gardée aussi longtemps que les résultats d'une
+    session inactive (JOB_RETENTION_SECONDS pour une autre durée) ; ses
+    contenus sont déjà dans le stockage des résultats (spill_yearly_result,
+    spill_monthly_result), elle ne garde en mémoire que des métadonnées.
+    """
+    return JobEngine(
+        max_workers=int(os.environ.get("JOB_WORKERS") or DEFAULT_JOB_WORKERS),
+        retention=int(os.environ.get("JOB_RETENTION_SECONDS") or get_result_store().ttl)
+    )
+
+@st.cache_resource
+def get_result_store():
+    """Contenus des résultats (PDF, ZIP) gardés hors de la session, pour toutes les sessions"""
+    return store_from_env()
+
+def get_session_results():
+    """Résultats de la session courante, marqués comme actifs"""
+    return get_result_store().session(st.session_state.result_session_id)
+
+@st.cache_resource
+def get_sync_manifest():
+    """Manifeste des bulletins déjà exportés, pour le mode incrémental (None si non configuré)"""
+    return manifest_from_env()
+
+def get_pipeline_context():
+    """Ressources passées aux tâches : elles ne doivent pas accéder elles-mêmes à st.*"""
+    return PipelineContext(
+        get_roster_cache(), get_payslip_index(), get_payslip_cache(),
+        get_extraction_pool(), get_archive_pool(), st.session_state.introspect_cache, get_sync_manifest()
+    )
+
+def incremental_checkbox(key):
+    """Case du mode incrémental, désactivée si aucun manifeste n'est configuré"""
+    return st.checkbox(
+        "🔁 Seulement les nouveaux bulletins (incrémental)",
+        disabled=get_sync_manifest() is None,
+        help="Ignore les bulletins dont la réception a été confirmée lors d'une récupération précédente, sauf s'ils ont été réémis"
+             if get_sync_manifest() is not None else "Définissez SYNC_MANIFEST_PATH pour activer ce mode",
+        key=key
+    )
+
+# Intervalle de rafraîchissement de l'avancement d'une tâche, en secondes
+JOB_POLL_INTERVAL = 1.0
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_job_progress(job_key, outcome_key, log_label, log_height, on_done):
+    """Affiche l'avancement de la tâche dont l'identifiant est dans st.session_state[job_key].
+
+    Seul ce fragment est réexécuté pendant la tâche ; quand elle se termine,
+    on_done(job) recopie ses résultats dans la session et toute la page est
+    réexécutée. Une tâche terminée puis retirée par le moteur avant d'avoir
+    été relue (onglet déconnecté trop longtemps) est signalée dans
+    st.session_state[outcome_key].
+    """
+    job_id = st.session_state.get(job_key)
+    if not job_id:
+        return
+    job = get_job_engine().get(job_id)
+    if job is None:
+        st.session_state[job_key] = None
+        st.session_state[outcome_key] = expired_job_outcome()
+        st.rerun()
+    
+    if job.finished:
+        get_job_engine().pop(job_id)
+        st.session_state[job_key] = None
+        on_done(job)
+        st.rerun()
+    
+    st.progress(job.progress)
+    if job.status:
+        level, message = job.status
+        getattr(st, level)(message)
+    for level, message in list(job.messages):
+        getattr(st, level)(message)
+    with st.expander("📊 Détails du traitement", expanded=False):
+        st.text_area(log_label, job.log.text(), height=log_height)
+    if st.button("⏹️ Annuler", key=f"{job_key}_cancel"):
+        job.cancel()
+
+def job_outcome(job):
+    """Ce qui reste affiché d'une tâche terminée : erreur, avertissements et journal"""
+    return {
+        "state": job.state,
+        "error": job.error,
+        "traceback": job.traceback,
+        "messages": list(job.messages),
+        "log": job.log.text()
+    }
+
+def expired_job_outcome():
+    """Compte rendu d'une tâche qui n'est plus dans le moteur"""
+    return {
+        "state": None,
+        "error": None,
+        "traceback": None,
+        "messages": [("warning", "⌛ Export expiré : ses résultats n'ont pas été relus à temps, relancez la récupération.")],
+        "log": ""
+    }
+
+def show_job_outcome(outcome, log_label, log_height):
+    if outcome is None:
+        return
+    if outcome["state"] == JOB_CANCELLED:
+        st.warning("⏹️ Traitement annulé.")
+    if outcome["error"]:
+        st.error(outcome["error"])
+    if outcome["traceback"]:
+        st.error(outcome["traceback"])
+    for level, message in outcome["messages"]:
+        getattr(st, level)(message)
+    if outcome["log"]:
+        with st.expander("📊 Détails du traitement", expanded=False):
+            st.text_area(log_label, outcome["log"], height=log_height)
 
 def create_csv_download(df, filename):
     csv = df.to_csv(index=False).encode('utf-8')
     return csv, filename
 
+# Champs de saisie de la clé API, vidés à l'envoi du formulaire
+API_KEY_INPUTS = ("monthly_api_key_input", "yearly_api_key_input")
+
+def take_api_key(input_key, handle_key):
+    """Rappel du bouton d'envoi : la clé saisie passe dans une SecretHandle et le champ est vidé,
+    pour que l'état du widget ne garde pas de copie de la clé"""
+    value = st.session_state.get(input_key, "")
+    st.session_state[handle_key] = SecretHandle(value) if value else None
+    st.session_state[input_key] = ""
+
 def check_api_key_in_memory():
-    gc.collect()
-    api_key_in_locals = 'api_key' in locals()
-    api_key_in_globals = 'api_key' in globals()
-    
-    api_key_refs = []
-    for obj in gc.get_objects():
-        try:
-            if isinstance(obj, str) and len(obj) > 20 and 'api' in obj.lower():
-                api_key_refs.append(obj)
-        except:
-            pass
+    """État des clés API de la session, sans parcourir le tas : chaque clé transmise
+    à une tâche est une SecretHandle qui suit elle-même ses copies"""
+    handles = [handle for handle in (st.session_state.monthly_api_key, st.session_state.yearly_api_key)
+               if handle is not None]
     
     results = {
-        "API Key dans variables locales": api_key_in_locals,
-        "API Key dans variables globales": api_key_in_globals,
-        "Nombre de références potentielles à API Key": len(api_key_refs)
+        "API Key dans variables globales": 'api_key' in globals(),
+        "Clés API dans les champs de saisie": sum(1 for key in API_KEY_INPUTS if st.session_state.get(key)),
+        "Clés API encore en mémoire": sum(1 for handle in handles if handle.resident),
+        "Copies de clés API en cours d'utilisation": sum(handle.copies for handle in handles)
     }
     
     return results
 
 # ==================== FONCTIONS BULLETINS ANNUELS ====================
 
-def get_company_and_collaborators(api_key):
-    """Fonction commune pour récupérer les infos de l'entreprise et les collaborateurs"""
-    BASE_URL = "https://partner-api.payfit.com"
-    
-    headers_json = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_key}'
-    }
-    headers_auth = {
-        'Authorization': f'Bearer {api_key}'
-    }
-    
-    # Vérification de la clé API
-    resp = requests.post("https://oauth.payfit.com/introspect", headers=headers_json, data=json.dumps({"token": api_key}))
-    
-    try:
-        data = resp.json()
-        if not data.get("active"):
-            return None, None, None, None
-        
-        company_id = data["company_id"]
-        
-        # Infos de l'entreprise
-        company_info = requests.get(f"{BASE_URL}/companies/{company_id}", headers=headers_auth).json()
-        
-        # Récupération des collaborateurs avec pagination
-        all_collabs = []
-        next_page_token = None
-        
-        while True:
-            params = {"nextPageToken": next_page_token} if next_page_token else {}
-            response = requests.get(f"{BASE_URL}/companies/{company_id}/collaborators", headers=headers_auth, params=params)
-            
-            if response.status_code != 200:
-                break
-            
-            collabs_response = response.json()
-            page_collabs = collabs_response.get("collaborators", [])
-            all_collabs.extend(page_collabs)
-            
-            next_page_token = collabs_response.get("meta", {}).get("nextPageToken")
-            if not next_page_token:
-                break
-        
-        return company_id, company_info, all_collabs, headers_auth
-        
-    except Exception as e:
-        st.error(f"Erreur lors de la récupération des données: {str(e)}")
-        return None, None, None, None
+def get_yearly_payslips(api_key, start_period, end_period, max_workers=DEFAULT_MAX_WORKERS, refresh_roster=False,
+                        streaming_zip=False, compression=None, incremental=False, profile=False):
+    """Lance en tâche de fond la récupération d'une année ou d'une période (année, mois) à (année, mois)
 
-def get_yearly_payslips(api_key, target_year):
-    if not api_key or not target_year:
+    api_key est la SecretHandle prise par take_api_key, effacée à la fin de la récupération.
+    """
+    if not api_key or not start_period or not end_period:
         st.error("Tous les champs sont obligatoires!")
         return
-    
-    progress_bar = st.progress(0)
-    status_placeholder = st.empty()
-    
-    # Récupération des données communes
-    result = get_company_and_collaborators(api_key)
-    if result[0] is None:
-        st.error("❌ Clé API invalide ou expirée.")
+    if start_period > end_period:
+        st.error("La période de début doit précéder la période de fin.")
         return
     
-    company_id, company_info, collabs, headers_auth = result
-    BASE_URL = "https://partner-api.payfit.com"
-    
-    status_placeholder.success(f"✅ Clé valide. Entreprise : {company_info['name']}")
-    progress_bar.progress(10)
-    
-    # Structure pour organiser les bulletins par collaborateur
-    collaborator_payslips = {}  # {collaborator_name: {month: pdf_content}}
-    yearly_stats = {
-        'total_collaborators': len(collabs),
-        'collaborators_with_payslips': 0,
-        'total_payslips_found': 0,
-        'months_processed': set()
-    }
-    
-    with st.expander("📊 Détails du traitement", expanded=False):
-        details_placeholder = st.empty()
-        detail_text = "Début du traitement des bulletins annuels...\n\n"
-    
-    total_collabs = len(collabs)
-    for i, collab in enumerate(collabs):
-        progress_value = 10 + (i / total_collabs * 80)
-        progress_bar.progress(int(progress_value))
-        
-        collaborator_id = collab["id"]
-        full_name = f"{collab.get('firstName', '')} {collab.get('lastName', '')}".strip()
-        
-        status_placeholder.info(f"Traitement de {full_name}... ({i+1}/{total_collabs})")
-        detail_text += f"📝 Traitement de {full_name}...\n"
-        details_placeholder.text_area("Logs de traitement", detail_text, height=300)
-        
-        # Récupération de tous les bulletins du collaborateur
-        payslips_url = f"{BASE_URL}/companies/{company_id}/collaborators/{collaborator_id}/payslips/"
-        payslip_resp = requests.get(payslips_url, headers=headers_auth).json()
-        
-        if "payslips" not in payslip_resp or not payslip_resp["payslips"]:
-            detail_text += f"  ❌ Aucun bulletin disponible\n"
-            details_placeholder.text_area("Logs de traitement", detail_text, height=300)
-            continue
-        
-        # Filtrer les bulletins pour l'année cible (conversion en int pour éviter les erreurs de type)
-        yearly_payslips = [p for p in payslip_resp["payslips"] if int(p["year"]) == int(target_year)]
-        
-        if not yearly_payslips:
-            detail_text += f"  ❌ Aucun bulletin pour l'année {target_year}\n"
-            details_placeholder.text_area("Logs de traitement", detail_text, height=300)
-            continue
-        
-        # Initialiser le dictionnaire pour ce collaborateur
-        collaborator_payslips[full_name] = {}
-        collaborator_has_payslips = False
-        
-        detail_text += f"  ✅ {len(yearly_payslips)} bulletin(s) trouvé(s) pour {target_year}\n"
-        
-        # Télécharger chaque bulletin du collaborateur pour l'année
-        for payslip in yearly_payslips:
-            month = str(payslip["month"]).zfill(2)  # Conversion en string avec format 2 chiffres
-            contract_id = payslip["contractId"]
-            payslip_id = payslip["payslipId"]
-            
-            yearly_stats['months_processed'].add(month)
-            
-            pdf_url = f"{BASE_URL}/companies/{company_id}/collaborators/{collaborator_id}/contracts/{contract_id}/payslips/{payslip_id}"
-            pdf_response = requests.get(pdf_url, headers={**headers_auth, 'accept': 'application/pdf'})
-            
-            if pdf_response.status_code == 200:
-                # Extraire la 2ème page
-                extracted_content = extract_second_page(pdf_response.content)
-                if extracted_content:
-                    collaborator_payslips[full_name][month] = {
-                        'content': extracted_content,
-                        'file_name': f"{full_name.replace(' ', '_')}_{target_year}_{month.zfill(2)}.pdf"
-                    }
-                    collaborator_has_payslips = True
-                    yearly_stats['total_payslips_found'] += 1
-                    detail_text += f"    ✅ Mois {month} - bulletin récupéré\n"
-                else:
-                    detail_text += f"    ⚠️ Mois {month} - impossible d'extraire la 2ème page\n"
-            else:
-                detail_text += f"    ❌ Mois {month} - erreur téléchargement (code {pdf_response.status_code})\n"
-        
-        if collaborator_has_payslips:
-            yearly_stats['collaborators_with_payslips'] += 1
-        
-        detail_text += "\n"
-        details_placeholder.text_area("Logs de traitement", detail_text, height=300)
-    
-    progress_bar.progress(100)
-    status_placeholder.success("✅ Traitement terminé!")
+    run = (run_profiled, run_range) if profile else (run_range,)
+    job = get_job_engine().submit(
+        "yearly", spill_yearly_result, get_session_results(), *run, api_key, get_pipeline_context(), start_period, end_period,
+        max_workers, refresh_roster, streaming_zip, compression, incremental
+    )
+    st.session_state.yearly_job_id = job.id
+
+def spill_yearly_result(job, results, run, *args):
+    """Exécute run puis range ses contenus dans le segment "yearly" de la session, depuis le
+    thread de la tâche : une tâche terminée mais jamais relue ne garde que des métadonnées.
+
+    Le segment remplace celui de la récupération précédente ; zip_content devient zip_body.
+    """
+    result = run(job, *args)
+    segment = results.open("yearly")
+    try:
+        if result["archive"] is not None:
+            segment.adopt(result["archive"], result["archive"].size)
+        for months_data in result["collaborator_payslips"].values():
+            for payslip_data in months_data.values():
+                if 'content' in payslip_data:
+                    payslip_data['body'] = segment.put(payslip_data.pop('content'))
+        zip_content = result.pop("zip_content")
+        result["zip_body"] = segment.put(zip_content) if zip_content else None
+    except ResultQuotaExceeded as e:
+        results.discard("yearly")
+        if result["archive"] is not None:
+            result["archive"].close()
+        raise JobError(f"❌ {e}")
+    return result
+
+def apply_yearly_result(job):
+    """Recopie dans la session le résultat d'une tâche annuelle terminée"""
+    st.session_state.yearly_outcome = job_outcome(job)
+    if job.state != JOB_DONE:
+        return
+    result = job.result
     
     # Stockage des résultats
-    st.session_state.yearly_payslip_data = collaborator_payslips
-    st.session_state.yearly_stats = yearly_stats
-    st.session_state.yearly_target_year = target_year
-    st.session_state.yearly_company_info = company_info
+    st.session_state.yearly_payslip_data = result["collaborator_payslips"]
+    st.session_state.yearly_summary = None
+    st.session_state.yearly_collab_zips = {}
+    st.session_state.yearly_stats = result["yearly_stats"]
+    st.session_state.yearly_period_label = result["period_label"]
+    st.session_state.yearly_period_slug = result["period_slug"]
+    st.session_state.yearly_multi_year = result["start_period"][0] != result["end_period"][0]
+    st.session_state.yearly_metrics = result["metrics"]
+    st.session_state.yearly_profile = result.get("profile")
     st.session_state.yearly_show_results = True
     
-    # Création du ZIP global
-    if collaborator_payslips:
-        create_yearly_zip(collaborator_payslips, target_year)
+    # ZIP global, stocké ou dans une archive sur disque
+    st.session_state.yearly_compression_policy = result["policy"]
+    st.session_state.yearly_zip_archive = result["archive"]
+    st.session_state.yearly_zip_body = result["zip_body"]
+    st.session_state.yearly_zip_stats = result["zip_stats"]
+    st.session_state.yearly_export = exported_payslips(result)
+    st.session_state.yearly_served = set()
+    if result["period_slug"].isdigit():
+        st.session_state.yearly_zip_filename = f"bulletins_paie_annee_{result['period_slug']}.zip"
+    else:
+        st.session_state.yearly_zip_filename = f"bulletins_paie_{result['period_slug']}.zip"
 
-def create_yearly_zip(collaborator_payslips, target_year):
-    """Créer un ZIP organisé avec tous les bulletins de l'année"""
-    zip_buffer = io.BytesIO()
-    
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for collaborator_name, months_data in collaborator_payslips.items():
-            # Créer un dossier par collaborateur
-            safe_name = collaborator_name.replace(' ', '_').replace('/', '_')
-            
-            for month, payslip_data in months_data.items():
-                # Chemin dans le ZIP : Collaborateur/fichier.pdf
-                file_path_in_zip = f"{safe_name}/{payslip_data['file_name']}"
-                zipf.writestr(file_path_in_zip, payslip_data['content'])
+def exported_payslips(result):
+    """Ce que record_exported lit d'un résultat, gardé jusqu'à la confirmation de l'export"""
+    return {"company_id": result["company_id"], "exported_jobs": result["exported_jobs"]}
+
+def mark_served(served_key, names):
+    """Rappel des boutons de téléchargement : note les collaborateurs dont les bulletins ont été servis"""
+    st.session_state[served_key].update(names)
+
+def confirm_export(export, served_key, button_key):
+    """Bouton qui marque comme exportés, dans le manifeste, les bulletins déjà téléchargés.
+
+    Streamlit ne signale pas la fin d'un téléchargement : un clic sur un
+    bouton de téléchargement ne prouve pas que le fichier est arrivé.
+    L'utilisateur confirme donc lui-même la réception ; tant qu'il ne l'a
+    pas fait, la prochaine récupération incrémentale reprend ces bulletins.
+    """
+    manifest = get_sync_manifest()
+    if manifest is None or export is None:
+        return
+    served = st.session_state[served_key]
+    pending = [job for job in export["exported_jobs"] if job["full_name"] in served]
+    if not pending:
+        return
+    st.button(
+        f"✅ Fichiers bien reçus : marquer {len(pending)} bulletin(s) comme exporté(s)", key=button_key,
+        help="Les récupérations incrémentales suivantes ignoreront ces bulletins, sauf s'ils sont réémis",
+        on_click=record_confirmed, args=(manifest, export["company_id"], pending, served_key)
+    )
+
+def record_confirmed(manifest, company_id, jobs, served_key):
+    """Rappel du bouton de confirmation : enregistre les bulletins reçus avant la réexécution de la page"""
+    record_exported(manifest, {"company_id": company_id, "exported_jobs": jobs})
+    st.session_state[served_key].difference_update(job["full_name"] for job in jobs)
+    st.toast(f"♻️ {len(jobs)} bulletin(s) marqué(s) comme exporté(s).")
+
+# Taille au-delà de laquelle un ZIP complet n'est plus proposé au téléchargement
+# (DOWNLOAD_MAX_BYTES pour une autre limite) : Streamlit charge en mémoire tout
+# fichier servi, à chaque clic, même quand l'archive est sur disque
+DEFAULT_DOWNLOAD_MAX_BYTES = 512 * 1024 * 1024
+
+def download_too_large(size):
+    """Affiche un avertissement et renvoie True si le ZIP dépasse la taille que l'application sert"""
+    limit = int(os.environ.get("DOWNLOAD_MAX_BYTES") or DEFAULT_DOWNLOAD_MAX_BYTES)
+    if size <= limit:
+        return False
+    st.warning(
+        f"📦 L'archive fait {size / 1e6:.0f} Mo, au-delà des {limit / 1e6:.0f} Mo que l'application peut servir. "
+        "Téléchargez les bulletins séparément ou utilisez la ligne de commande (`python payslip_cli.py`)."
+    )
+    return True
+
+def build_yearly_summary(collaborator_payslips, with_year=False):
+    """Renvoie (tableau récapitulatif, {collaborateur: mois abrégés}) ; with_year ajoute l'année à chaque mois"""
+    def month_names(periods, date_format):
+        if with_year:
+            date_format += " %Y"
+        return ", ".join([datetime(int(p[:4]), int(p[5:]), 1).strftime(date_format) for p in periods])
     
-    zip_buffer.seek(0)
-    st.session_state.yearly_zip_content = zip_buffer.getvalue()
-    st.session_state.yearly_zip_filename = f"bulletins_paie_annee_{target_year}.zip"
+    summary_data = []
+    short_months = {}
+    for collab_name, months_data in collaborator_payslips.items():
+        periods = sorted(months_data.keys())  # "AAAA-MM"
+        months_str = month_names(periods, "%B")
+        short_months[collab_name] = month_names(periods, "%b")
+        
+        summary_data.append({
+            "Collaborateur": collab_name,
+            "Nombre de bulletins": len(months_data),
+            "Mois disponibles": months_str
+        })
+    return pd.DataFrame(summary_data), short_months
+
+def collaborator_zip_builder(memo, segment, collab_name, period_slug, months_data, archive, policy, executor):
+    """Fonction qui construit le ZIP d'un collaborateur au premier téléchargement, puis le garde dans memo.
+
+    Elle est appelée par Streamlit lors du clic, hors de l'exécution du
+    script : tout ce dont elle a besoin est passé en argument. Le ZIP est
+    écrit dans segment ; memo n'en garde que la référence.
+    """
+    def build():
+        key = (collab_name, period_slug)
+        if key in memo:
+            return memo[key].read()
+        if archive is not None:
+            # Bulletins relus depuis l'archive sur disque
+            content = archive.read_subset([payslip_data['zip_path'] for payslip_data in months_data.values()])
+        else:
+            content, _ = build_zip(
+                ((payslip_data['file_name'], payslip_data['body'].read()) for payslip_data in months_data.values()),
+                policy,
+                executor
+            )
+        try:
+            memo[key] = segment.put(content)
+        except ResultQuotaExceeded:
+            pass  # Quota atteint : le ZIP sera reconstruit au prochain clic
+        return content
+    return build
 
 def display_yearly_results():
     if not st.session_state.yearly_show_results:
         return
+    segment = get_session_results().get("yearly")
+    if segment is None:
+        st.session_state.yearly_show_results = False
+        st.info("⌛ Les résultats précédents ont expiré ; relancez la récupération pour les retrouver.")
+        return
     
     collaborator_payslips = st.session_state.yearly_payslip_data
     yearly_stats = st.session_state.yearly_stats
-    target_year = st.session_state.yearly_target_year
-    company_info = st.session_state.yearly_company_info
+    period_label = st.session_state.yearly_period_label
+    period_slug = st.session_state.yearly_period_slug
+    period_text = f"l'année {period_label}" if period_slug.isdigit() else f"la période {period_label}"
     
-    st.subheader(f"📊 Résultats pour l'année {target_year}")
+    st.subheader(f"📊 Résultats pour {period_text}")
     
     # Statistiques globales
     col1, col2, col3, col4 = st.columns(4)
@@ -287,300 +522,214 @@ def display_yearly_results():
         st.metric("Total bulletins", yearly_stats['total_payslips_found'])
     with col4:
         st.metric("Mois couverts", len(yearly_stats['months_processed']))
+    display_run_metrics(st.session_state.yearly_metrics, f"periode_{period_slug}", mode="yearly", period=period_slug)
+    display_run_profile(st.session_state.yearly_profile)
     
-    # Bouton de téléchargement global
-    if 'yearly_zip_content' in st.session_state and st.session_state.yearly_zip_content:
+    # Bouton de téléchargement global (archive sur disque lue seulement au clic)
+    yearly_zip_archive = st.session_state.yearly_zip_archive
+    yearly_zip_body = st.session_state.yearly_zip_body
+    yearly_zip = yearly_zip_archive if yearly_zip_archive is not None else yearly_zip_body
+    if yearly_zip is not None and not download_too_large(yearly_zip.size):
         st.download_button(
-            label=f"📥 Télécharger tous les bulletins {target_year} (ZIP)",
-            data=st.session_state.yearly_zip_content,
+            label=f"📥 Télécharger tous les bulletins {period_label} (ZIP)",
+            data=yearly_zip.read,
             file_name=st.session_state.yearly_zip_filename,
             mime="application/zip",
-            help=f"Archive contenant {yearly_stats['total_payslips_found']} bulletins organisés par collaborateur"
+            on_click=mark_served, args=("yearly_served", tuple(collaborator_payslips)),
+            help=f"Archive contenant {yearly_stats['total_payslips_found']} bulletins organisés par "
+                 + ("année et par collaborateur" if st.session_state.yearly_multi_year else "collaborateur")
         )
+        if st.session_state.yearly_zip_stats:
+            st.caption(format_archive_stats(st.session_state.yearly_zip_stats, st.session_state.yearly_compression_policy))
     
     # Détail par collaborateur
     st.subheader("👥 Détail par collaborateur")
     
     if collaborator_payslips:
-        # Créer un tableau récapitulatif
-        summary_data = []
-        for collab_name, months_data in collaborator_payslips.items():
-            months_list = sorted([int(m) for m in months_data.keys()])
-            months_str = ", ".join([datetime(2000, m, 1).strftime("%B") for m in months_list])
-            
-            summary_data.append({
-                "Collaborateur": collab_name,
-                "Nombre de bulletins": len(months_data),
-                "Mois disponibles": months_str
-            })
-        
-        df_summary = pd.DataFrame(summary_data)
+        # Tableau récapitulatif et libellés des mois calculés une seule fois par résultat
+        if st.session_state.yearly_summary is None:
+            st.session_state.yearly_summary = build_yearly_summary(
+                collaborator_payslips, st.session_state.yearly_multi_year
+            )
+        df_summary, short_months = st.session_state.yearly_summary
         st.dataframe(df_summary, use_container_width=True)
         
-        # Téléchargements individuels par collaborateur
+        # Téléchargements individuels par collaborateur : chaque ZIP n'est construit qu'au clic
+        archive_pool = get_archive_pool()
         with st.expander("📁 Téléchargements individuels par collaborateur", expanded=False):
             for collab_name, months_data in collaborator_payslips.items():
                 st.write(f"**{collab_name}** - {len(months_data)} bulletin(s)")
                 
-                # Créer un ZIP spécifique pour ce collaborateur
-                collab_zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(collab_zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for month, payslip_data in months_data.items():
-                        zipf.writestr(payslip_data['file_name'], payslip_data['content'])
-                
-                collab_zip_buffer.seek(0)
-                
                 col1, col2 = st.columns([3, 1])
                 with col1:
-                    months_list = sorted([int(m) for m in months_data.keys()])
-                    months_str = ", ".join([datetime(2000, m, 1).strftime("%b") for m in months_list])
-                    st.write(f"Mois : {months_str}")
+                    st.write(f"Mois : {short_months[collab_name]}")
                 with col2:
                     st.download_button(
                         label="📥 ZIP collaborateur",
-                        data=collab_zip_buffer.getvalue(),
-                        file_name=f"{collab_name.replace(' ', '_')}_bulletins_{target_year}.zip",
+                        data=collaborator_zip_builder(
+                            st.session_state.yearly_collab_zips, segment, collab_name, period_slug, months_data,
+                            yearly_zip_archive, st.session_state.yearly_compression_policy, archive_pool
+                        ),
+                        file_name=f"{collab_name.replace(' ', '_')}_bulletins_{period_slug}.zip",
                         mime="application/zip",
-                        key=f"collab_{collab_name.replace(' ', '_')}"
+                        key=f"collab_{collab_name.replace(' ', '_')}",
+                        on_click=mark_served, args=("yearly_served", (collab_name,))
                     )
+        confirm_export(st.session_state.yearly_export, "yearly_served", "yearly_confirm_export")
     else:
-        st.warning(f"Aucun bulletin trouvé pour l'année {target_year}")
+        st.warning(f"Aucun bulletin trouvé pour {period_text}")
 
 # ==================== FONCTIONS BULLETINS MENSUELS ====================
 
-def get_payslips(api_key, target_year, target_month):
+def get_payslips(api_key, target_year, target_month, max_workers=DEFAULT_MAX_WORKERS, refresh_roster=False,
+                 incremental=False, profile=False):
+    """Lance la récupération mensuelle en tâche de fond (api_key : SecretHandle prise par take_api_key)"""
     if not api_key or not target_year or not target_month:
         st.error("Tous les champs sont obligatoires!")
         return
     
-    BASE_URL = "https://partner-api.payfit.com"
-    
-    headers_json = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_key}'
-    }
-    headers_auth = {
-        'Authorization': f'Bearer {api_key}'
-    }
-    
-    progress_bar = st.progress(0)
-    status_placeholder = st.empty()
+    run = (run_profiled, run_monthly) if profile else (run_monthly,)
+    job = get_job_engine().submit(
+        "monthly", spill_monthly_result, get_session_results(), *run, api_key, get_pipeline_context(), target_year, target_month,
+        max_workers, refresh_roster, incremental
+    )
+    st.session_state.monthly_job_id = job.id
+
+def spill_monthly_result(job, results, run, *args):
+    """Comme spill_yearly_result, pour le segment "monthly" : les contenus de payslip_data
+    deviennent des "body" et zip_content devient zip_body"""
+    result = run(job, *args)
+    segment = results.open("monthly")
+    try:
+        result["payslip_data"] = {
+            name: {"file_name": data["file_name"], "body": segment.put(data["content"])}
+            for name, data in result["payslip_data"].items()
+        }
+        zip_content = result.pop("zip_content")
+        result["zip_body"] = segment.put(zip_content) if zip_content else None
+    except ResultQuotaExceeded as e:
+        results.discard("monthly")
+        raise JobError(f"❌ {e}")
+    return result
+
+def apply_monthly_result(job):
+    """Recopie dans la session le résultat d'une tâche mensuelle terminée"""
+    st.session_state.monthly_outcome = job_outcome(job)
+    if job.state != JOB_DONE:
+        st.session_state.show_results = False
+        return
+    result = job.result
     
-    # 1. Vérification de la clé API
-    status_placeholder.info("🔎 Vérification de la clé API...")
-    resp = requests.post("https://oauth.payfit.com/introspect", headers=headers_json, data=json.dumps({"token": api_key}))
+    st.session_state.company_id = result["company_id"]
+    st.session_state.company_info = result["company_info"]
     
-    try:
-        data = resp.json()
-        if not data.get("active"):
-            st.error("❌ Clé API invalide ou expirée.")
-            return
-        
-        company_id = data["company_id"]
-        status_placeholder.success(f"✅ Clé valide. Entreprise ID : {company_id}")
-        progress_bar.progress(10)
-        
-        # 2. Infos détaillées de l'entreprise
-        company_info = requests.get(f"{BASE_URL}/companies/{company_id}", headers=headers_auth).json()
-        
-        with st.expander("🏢 Informations détaillées de l'entreprise", expanded=True):
-            col1, col2 = st.columns(2)
-            with col1:
-                st.write(f"**Nom de l'entreprise:** {company_info['name']}")
-                st.write(f"**ID de l'entreprise:** {company_id}")
-                st.write(f"**Contrats actifs:** {company_info['nbActiveContracts']}")
-            with col2:
-                if 'countryCode' in company_info:
-                    st.write(f"**Pays:** {company_info['countryCode']}")
-                if 'city' in company_info:
-                    st.write(f"**Ville:** {company_info['city']}")
-                if 'postalCode' in company_info:
-                    st.write(f"**Code postal:** {company_info['postalCode']}")
-            
-            st.subheader("Informations supplémentaires")
-            remaining_info = {k: v for k, v in company_info.items() 
-                             if k not in ['name', 'countryCode', 'city', 'postalCode', 'nbActiveContracts']}
-            st.json(remaining_info)
-        
-        progress_bar.progress(20)
-        
-        # 3. Récupération des collaborateurs avec pagination
-        status_placeholder.info("📥 Récupération des collaborateurs...")
-        all_collabs = []
-        next_page_token = None
-        
-        page_count = 0
-        while True:
-            page_count += 1
-            params = {"nextPageToken": next_page_token} if next_page_token else {}
-            response = requests.get(f"{BASE_URL}/companies/{company_id}/collaborators", headers=headers_auth, params=params)
-            
-            if response.status_code != 200:
-                st.error(f"❌ Erreur lors de la récupération des collaborateurs: {response.status_code}")
-                break
-            
-            collabs_response = response.json()
-            page_collabs = collabs_response.get("collaborators", [])
-            all_collabs.extend(page_collabs)
-            
-            status_placeholder.info(f"📥 Récupération des collaborateurs... Page {page_count} ({len(all_collabs)} collaborateurs jusqu'à présent)")
+    # Liste des collaborateurs et export CSV
+    collabs = result["collabs"]
+    if collabs:
+        collabs_data = []
+        for collab in collabs:
+            collab_data = {
+                "ID": collab.get("id", ""),
+                "Prénom": collab.get("firstName", ""),
+                "Nom": collab.get("lastName", ""),
+                "Email": collab.get("email", ""),
+                "Statut": "Actif" if collab.get("status") == "active" else "Inactif"
+            }
+            if "startDate" in collab:
+                collab_data["Date de début"] = collab["startDate"]
+            if "endDate" in collab:
+                collab_data["Date de fin"] = collab["endDate"]
             
-            next_page_token = collabs_response.get("meta", {}).get("nextPageToken")
-            if not next_page_token:
-                break
-        
-        collabs = all_collabs
-        status_placeholder.success(f"✅ {len(collabs)} collaborateurs récupérés.")
-        progress_bar.progress(30)
-        
-        # Affichage de tous les collaborateurs
-        with st.expander("👥 Liste complète des collaborateurs", expanded=True):
-            if collabs:
-                collabs_data = []
-                for collab in collabs:
-                    collab_data = {
-                        "ID": collab.get("id", ""),
-                        "Prénom": collab.get("firstName", ""),
-                        "Nom": collab.get("lastName", ""),
-                        "Email": collab.get("email", ""),
-                        "Statut": "Actif" if collab.get("status") == "active" else "Inactif"
-                    }
-                    if "startDate" in collab:
-                        collab_data["Date de début"] = collab["startDate"]
-                    if "endDate" in collab:
-                        collab_data["Date de fin"] = collab["endDate"]
-                    
-                    collabs_data.append(collab_data)
-                
-                df = pd.DataFrame(collabs_data)
-                st.dataframe(df, use_container_width=True)
-                
-                csv_data, csv_filename = create_csv_download(
-                    df, 
-                    f"collaborateurs_{company_info['name']}_{datetime.now().strftime('%Y%m%d')}.csv"
-                )
-                
-                st.session_state.csv_data = csv_data
-                st.session_state.csv_filename = csv_filename
-                st.session_state.show_download_button = True
-            else:
-                st.warning("Aucun collaborateur trouvé.")
-                st.session_state.show_download_button = False
-        
-        os.makedirs("bulletins_paie", exist_ok=True)
-        
-        # 4. Filtrage + extraction
-        status_placeholder.info("🔍 Recherche des bulletins de paie...")
+            collabs_data.append(collab_data)
         
-        collabs_with_payslip = []
-        collabs_without_payslip = []
-        payslip_data = {}
-        
-        with st.expander("Détails du traitement", expanded=False):
-            details_placeholder = st.empty()
-            detail_text = ""
-        
-        total_collabs = len(collabs)
-        for i, collab in enumerate(collabs):
-            progress_value = 30 + (i / total_collabs * 60)
-            progress_bar.progress(int(progress_value))
-            
-            collaborator_id = collab["id"]
-            full_name = f"{collab.get('firstName', '')} {collab.get('lastName', '')}".strip()
-            
-            detail_text += f"Traitement de {full_name}...\n"
-            details_placeholder.text_area("Logs", detail_text, height=400)
-            
-            payslips_url = f"{BASE_URL}/companies/{company_id}/collaborators/{collaborator_id}/payslips/"
-            payslip_resp = requests.get(payslips_url, headers=headers_auth).json()
-            
-            if "payslips" not in payslip_resp or not payslip_resp["payslips"]:
-                collabs_without_payslip.append({
-                    "name": full_name,
-                    "id": collaborator_id,
-                    "reason": "Aucun bulletin disponible"
-                })
-                detail_text += f"  → Aucun bulletin disponible\n"
-                details_placeholder.text_area("Logs", detail_text, height=400)
-                continue
-            
-            target_payslip = next(
-                (p for p in payslip_resp["payslips"] if p["year"] == target_year and p["month"] == target_month),
-                None
-            )
-            
-            if target_payslip:
-                collabs_with_payslip.append({
-                    "name": full_name,
-                    "id": collaborator_id,
-                    "payslip_info": target_payslip
-                })
-                detail_text += f"  → ✅ Bulletin trouvé pour {target_month}/{target_year}\n"
-                details_placeholder.text_area("Logs", detail_text, height=400)
-                
-                contract_id = target_payslip["contractId"]
-                payslip_id = target_payslip["payslipId"]
-                
-                pdf_url = f"{BASE_URL}/companies/{company_id}/collaborators/{collaborator_id}/contracts/{contract_id}/payslips/{payslip_id}"
-                pdf_response = requests.get(pdf_url, headers={**headers_auth, 'accept': 'application/pdf'})
-                
-                if pdf_response.status_code == 200:
-                    file_safe_name = f"{collab.get('firstName', 'collaborateur')}_{collab.get('lastName', '')}".replace(" ", "_")
-                    file_name = f"{file_safe_name}_{target_year}_{target_month}.pdf"
-                    
-                    extracted_content = extract_second_page(pdf_response.content)
-                    if extracted_content:
-                        payslip_data[full_name] = {
-                            "file_name": file_name,
-                            "content": extracted_content
-                        }
-                        detail_text += f"  → ✅ 2ème page extraite et prête pour téléchargement\n"
-                    else:
-                        detail_text += f"  → ⚠️ Impossible d'extraire la 2ème page\n"
-                else:
-                    detail_text += f"  → ❌ Erreur lors du téléchargement du bulletin de paie (code {pdf_response.status_code})\n"
-                
-                details_placeholder.text_area("Logs", detail_text, height=400)
-            else:
-                collabs_without_payslip.append({
-                    "name": full_name,
-                    "id": collaborator_id,
-                    "reason": f"Pas de bulletin pour {target_month}/{target_year}",
-                    "available_periods": [f"{p['month']}/{p['year']}" for p in payslip_resp["payslips"]]
-                })
-                detail_text += f"  → Pas de bulletin pour {target_month}/{target_year}\n"
-                details_placeholder.text_area("Logs", detail_text, height=400)
-        
-        progress_bar.progress(100)
-        status_placeholder.success("✅ Traitement terminé!")
-        
-        # Stockage des données dans la session_state
-        st.session_state.payslip_data = payslip_data
-        st.session_state.collabs_with_payslip = collabs_with_payslip
-        st.session_state.collabs_without_payslip = collabs_without_payslip
-        st.session_state.target_year = target_year
-        st.session_state.target_month = target_month
-        st.session_state.show_results = True
+        df = pd.DataFrame(collabs_data)
+        csv_data, csv_filename = create_csv_download(
+            df, 
+            f"collaborateurs_{result['company_info']['name']}_{datetime.now().strftime('%Y%m%d')}.csv"
+        )
         
-        if payslip_data:
-            zip_content = create_zip_in_memory(payslip_data)
-            st.session_state.zip_content = zip_content
-            st.session_state.zip_filename = f"bulletins_paie_{target_year}_{target_month}.zip"
+        st.session_state.collabs_df = df
+        st.session_state.csv_data = csv_data
+        st.session_state.csv_filename = csv_filename
+        st.session_state.show_download_button = True
+    else:
+        st.session_state.collabs_df = None
+        st.session_state.show_download_button = False
+    
+    # Stockage des données dans la session_state
+    st.session_state.payslip_data = result["payslip_data"]
+    st.session_state.collabs_with_payslip = result["collabs_with_payslip"]
+    st.session_state.collabs_without_payslip = result["collabs_without_payslip"]
+    st.session_state.target_year = result["target_year"]
+    st.session_state.target_month = result["target_month"]
+    st.session_state.show_results = True
+    st.session_state.zip_body = result["zip_body"]
+    st.session_state.zip_stats = result["zip_stats"]
+    st.session_state.monthly_compression_policy = result["policy"]
+    st.session_state.monthly_export = exported_payslips(result)
+    st.session_state.monthly_served = set()
+    st.session_state.monthly_metrics = result["metrics"]
+    st.session_state.monthly_profile = result.get("profile")
+    if result["zip_body"] is not None:
+        st.session_state.zip_filename = f"bulletins_paie_{result['target_year']}_{result['target_month']}.zip"
+
+def display_company_info(company_id, company_info):
+    with st.expander("🏢 Informations détaillées de l'entreprise", expanded=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write(f"**Nom de l'entreprise:** {company_info['name']}")
+            st.write(f"**ID de l'entreprise:** {company_id}")
+            st.write(f"**Contrats actifs:** {company_info['nbActiveContracts']}")
+        with col2:
+            if 'countryCode' in company_info:
+                st.write(f"**Pays:** {company_info['countryCode']}")
+            if 'city' in company_info:
+                st.write(f"**Ville:** {company_info['city']}")
+            if 'postalCode' in company_info:
+                st.write(f"**Code postal:** {company_info['postalCode']}")
         
-    except Exception as e:
-        st.error(f"Une erreur est survenue: {str(e)}")
-        import traceback
-        st.error(traceback.format_exc())
-        st.session_state.traitement_termine = False
-        st.session_state.show_results = False
+        st.subheader("Informations supplémentaires")
+        remaining_info = {k: v for k, v in company_info.items() 
+                         if k not in ['name', 'countryCode', 'city', 'postalCode', 'nbActiveContracts']}
+        st.json(remaining_info)
+
+def display_collaborators(collabs_df):
+    with st.expander("👥 Liste complète des collaborateurs", expanded=True):
+        if collabs_df is not None:
+            st.dataframe(collabs_df, use_container_width=True)
+        else:
+            st.warning("Aucun collaborateur trouvé.")
 
 # ==================== INITIALISATION DES VARIABLES DE SESSION ====================
 
+# Résultats de vérification des clés API, communs aux deux onglets
+if 'introspect_cache' not in st.session_state:
+    st.session_state.introspect_cache = IntrospectionCache()
+# Identifiant des résultats de la session dans le stockage partagé
+if 'result_session_id' not in st.session_state:
+    st.session_state.result_session_id = uuid.uuid4().hex
+# Chaque exécution du script marque les résultats de la session comme actifs
+get_session_results()
+
+# Clé API transmise à la dernière tâche de chaque onglet (SecretHandle), pour le contrôle de la mémoire
+if 'monthly_api_key' not in st.session_state:
+    st.session_state.monthly_api_key = None
+if 'yearly_api_key' not in st.session_state:
+    st.session_state.yearly_api_key = None
+
+# Tâches en cours et compte rendu de la dernière tâche terminée, par onglet
+if 'monthly_job_id' not in st.session_state:
+    st.session_state.monthly_job_id = None
+if 'monthly_outcome' not in st.session_state:
+    st.session_state.monthly_outcome = None
+if 'yearly_job_id' not in st.session_state:
+    st.session_state.yearly_job_id = None
+if 'yearly_outcome' not in st.session_state:
+    st.session_state.yearly_outcome = None
+
 # Variables pour bulletins mensuels
 if 'show_download_button' not in st.session_state:
     st.session_state.show_download_button = False
-if 'traitement_termine' not in st.session_state:
-    st.session_state.traitement_termine = False
 if 'payslip_data' not in st.session_state:
     st.session_state.payslip_data = {}
 if 'show_results' not in st.session_state:
@@ -589,26 +738,64 @@ if 'collabs_with_payslip' not in st.session_state:
     st.session_state.collabs_with_payslip = []
 if 'collabs_without_payslip' not in st.session_state:
     st.session_state.collabs_without_payslip = []
-if 'zip_content' not in st.session_state:
-    st.session_state.zip_content = None
+if 'zip_body' not in st.session_state:
+    st.session_state.zip_body = None
 if 'zip_filename' not in st.session_state:
     st.session_state.zip_filename = ""
+if 'zip_stats' not in st.session_state:
+    st.session_state.zip_stats = None
+if 'monthly_compression_policy' not in st.session_state:
+    st.session_state.monthly_compression_policy = compression_policy_from_env()
+if 'company_id' not in st.session_state:
+    st.session_state.company_id = None
+if 'company_info' not in st.session_state:
+    st.session_state.company_info = None
+if 'collabs_df' not in st.session_state:
+    st.session_state.collabs_df = None
+if 'monthly_metrics' not in st.session_state:
+    st.session_state.monthly_metrics = None
+if 'monthly_profile' not in st.session_state:
+    st.session_state.monthly_profile = None
+if 'monthly_export' not in st.session_state:
+    st.session_state.monthly_export = None  # Bulletins à marquer comme exportés une fois leur réception confirmée
+if 'monthly_served' not in st.session_state:
+    st.session_state.monthly_served = set()  # Collaborateurs dont les bulletins ont été téléchargés
 
 # Variables pour bulletins annuels
 if 'yearly_payslip_data' not in st.session_state:
     st.session_state.yearly_payslip_data = {}
 if 'yearly_show_results' not in st.session_state:
     st.session_state.yearly_show_results = False
-if 'yearly_target_year' not in st.session_state:
-    st.session_state.yearly_target_year = None
+if 'yearly_period_label' not in st.session_state:
+    st.session_state.yearly_period_label = None
+if 'yearly_period_slug' not in st.session_state:
+    st.session_state.yearly_period_slug = None
+if 'yearly_multi_year' not in st.session_state:
+    st.session_state.yearly_multi_year = False
 if 'yearly_stats' not in st.session_state:
     st.session_state.yearly_stats = {}
-if 'yearly_zip_content' not in st.session_state:
-    st.session_state.yearly_zip_content = None
+if 'yearly_zip_body' not in st.session_state:
+    st.session_state.yearly_zip_body = None
 if 'yearly_zip_filename' not in st.session_state:
     st.session_state.yearly_zip_filename = ""
-if 'yearly_company_info' not in st.session_state:
-    st.session_state.yearly_company_info = {}
+if 'yearly_zip_archive' not in st.session_state:
+    st.session_state.yearly_zip_archive = None
+if 'yearly_summary' not in st.session_state:
+    st.session_state.yearly_summary = None
+if 'yearly_collab_zips' not in st.session_state:
+    st.session_state.yearly_collab_zips = {}  # {(collaborateur, période): ZIP déjà téléchargé}
+if 'yearly_zip_stats' not in st.session_state:
+    st.session_state.yearly_zip_stats = None
+if 'yearly_compression_policy' not in st.session_state:
+    st.session_state.yearly_compression_policy = compression_policy_from_env()
+if 'yearly_metrics' not in st.session_state:
+    st.session_state.yearly_metrics = None
+if 'yearly_profile' not in st.session_state:
+    st.session_state.yearly_profile = None
+if 'yearly_export' not in st.session_state:
+    st.session_state.yearly_export = None
+if 'yearly_served' not in st.session_state:
+    st.session_state.yearly_served = set()
 
 # ==================== INTERFACE PRINCIPALE ====================
 
@@ -625,7 +812,10 @@ with tab1:
     st.write("Téléchargez la deuxième page des bulletins de paie de vos collaborateurs pour un mois spécifique et obtenez des informations détaillées sur votre entreprise et vos collaborateurs.")
     
     with st.form(key="payslip_form"):
-        api_key = st.text_input("🔐 Clé API Payfit", type="password", help="Vous pouvez obtenir une clé API depuis votre compte Payfit")
+        st.text_input(
+            "🔐 Clé API Payfit", type="password", key="monthly_api_key_input",
+            help="Vous pouvez obtenir une clé API depuis votre compte Payfit"
+        )
         
         col1, col2 = st.columns(2)
         with col1:
@@ -643,11 +833,43 @@ with tab1:
                 index=current_month - 1 if current_month > 0 else 0
             )
         
-        submit_button = st.form_submit_button(label="📥 Récupérer les bulletins")
+        max_workers = st.number_input(
+            "⚡ Requêtes simultanées", min_value=1, max_value=32, value=DEFAULT_MAX_WORKERS,
+            help="Nombre de collaborateurs interrogés en parallèle (1 = traitement séquentiel)"
+        )
+        
+        refresh_roster = st.checkbox(
+            "🔄 Recharger les collaborateurs et les listes de bulletins",
+            help="Ces listes sont gardées en cache quelques minutes ; cochez pour forcer un rechargement complet"
+        )
+        incremental = incremental_checkbox("monthly_incremental")
+        profile = profiling_checkbox("monthly_profile_run")
+        
+        submit_button = st.form_submit_button(
+            label="📥 Récupérer les bulletins", disabled=st.session_state.monthly_job_id is not None,
+            on_click=take_api_key, args=("monthly_api_key_input", "monthly_api_key")
+        )
         
         if submit_button:
-            get_payslips(api_key, str(target_year), target_month)
-            del api_key
+            get_payslips(
+                st.session_state.monthly_api_key, str(target_year), target_month, int(max_workers), refresh_roster,
+                incremental, profile
+            )
+    
+    # Avancement de la tâche en cours, puis compte rendu de la dernière tâche
+    if st.session_state.monthly_job_id:
+        show_job_progress("monthly_job_id", "monthly_outcome", "Logs", 400, apply_monthly_result)
+    else:
+        show_job_outcome(st.session_state.monthly_outcome, "Logs", 400)
+    
+    # Bulletins libérés par le stockage des résultats (session inactive trop longtemps)
+    if st.session_state.show_results and get_session_results().get("monthly") is None:
+        st.session_state.show_results = False
+        st.info("⌛ Les résultats précédents ont expiré ; relancez la récupération pour les retrouver.")
+    
+    if st.session_state.show_results and st.session_state.company_info:
+        display_company_info(st.session_state.company_id, st.session_state.company_info)
+        display_collaborators(st.session_state.collabs_df)
     
     # Bouton de téléchargement CSV
     if st.session_state.show_download_button and 'csv_data' in st.session_state and 'csv_filename' in st.session_state:
@@ -676,20 +898,29 @@ with tab1:
             st.metric("Bulletins trouvés", len(collabs_with_payslip))
         with col3:
             st.metric("Bulletins manquants", len(collabs_without_payslip))
+        display_run_metrics(
+            st.session_state.monthly_metrics, f"{target_year}_{target_month}",
+            mode="monthly", period=f"{target_year}-{target_month}"
+        )
+        display_run_profile(st.session_state.monthly_profile)
         
         # Affichage des collaborateurs avec bulletins
         if collabs_with_payslip:
-            if 'zip_content' in st.session_state and st.session_state.zip_content:
+            if st.session_state.zip_body is not None:
                 col1, col2 = st.columns([3, 1])
                 with col1:
                     st.info(f"**{len(collabs_with_payslip)} bulletins trouvés pour la période {target_month}/{target_year}**")
                 with col2:
-                    st.download_button(
-                        label="📥 Télécharger tous les bulletins",
-                        data=st.session_state.zip_content,
-                        file_name=st.session_state.zip_filename,
-                        mime="application/zip",
-                    )
+                    if not download_too_large(st.session_state.zip_body.size):
+                        st.download_button(
+                            label="📥 Télécharger tous les bulletins",
+                            data=st.session_state.zip_body.read,
+                            file_name=st.session_state.zip_filename,
+                            mime="application/zip",
+                            on_click=mark_served, args=("monthly_served", tuple(payslip_data))
+                        )
+                if st.session_state.zip_stats:
+                    st.caption(format_archive_stats(st.session_state.zip_stats, st.session_state.monthly_compression_policy))
             
             st.write("---")
             st.subheader("Bulletins individuels")
@@ -702,11 +933,13 @@ with tab1:
                     key = f"dl_btn_{name.replace(' ', '_')}"
                     st.download_button(
                         label="Télécharger bulletin de paie",
-                        data=payslip_data[name]["content"],
+                        data=payslip_data[name]["body"].read,
                         file_name=payslip_data[name]["file_name"],
                         mime="application/pdf",
-                        key=key
+                        key=key,
+                        on_click=mark_served, args=("monthly_served", (name,))
                     )
+            confirm_export(st.session_state.monthly_export, "monthly_served", "monthly_confirm_export")
         else:
             st.warning("Aucun bulletin trouvé pour ce mois.")
         
@@ -733,7 +966,7 @@ with tab1:
 
 with tab2:
     st.header("📆 Récupération des bulletins de paie par année")
-    st.write("Récupérez tous les bulletins de paie de vos collaborateurs pour une année complète.")
+    st.write("Récupérez tous les bulletins de paie de vos collaborateurs pour une année complète ou une période de plusieurs mois ou années.")
     
     # Initialisation des variables de session pour la page annuelle
     if 'yearly_show_results' not in st.session_state:
@@ -741,18 +974,81 @@ with tab2:
     if 'yearly_payslip_data' not in st.session_state:
         st.session_state.yearly_payslip_data = {}
     
+    # Hors du formulaire, pour que les champs de la période s'adaptent au choix
+    range_mode = st.radio(
+        "Période", options=[False, True], horizontal=True, key="yearly_range_mode",
+        format_func=lambda x: "Période personnalisée" if x else "Année complète",
+        help="Une période sur plusieurs années ne lit qu'une fois la liste des bulletins de chaque collaborateur"
+    )
+    
     with st.form(key="yearly_payslip_form"):
-        api_key = st.text_input("🔐 Clé API Payfit", type="password", help="Vous pouvez obtenir une clé API depuis votre compte Payfit")
+        st.text_input(
+            "🔐 Clé API Payfit", type="password", key="yearly_api_key_input",
+            help="Vous pouvez obtenir une clé API depuis votre compte Payfit"
+        )
         
         current_year = datetime.now().year
         years = list(range(current_year-5, current_year+1))
-        target_year = st.selectbox("📅 Année", options=years, index=len(years)-2)  # Année précédente par défaut
+        month_options = [str(i).zfill(2) for i in range(1, 13)]
+        month_label = lambda x: datetime(2000, int(x), 1).strftime("%B")
+        if range_mode:
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                start_year = st.selectbox("📅 Du (année)", options=years, index=len(years)-3, key="range_start_year")
+            with col2:
+                start_month = st.selectbox("Mois", options=month_options, format_func=month_label, key="range_start_month")
+            with col3:
+                end_year = st.selectbox("📅 Au (année)", options=years, index=len(years)-2, key="range_end_year")
+            with col4:
+                end_month = st.selectbox("Mois", options=month_options, index=11, format_func=month_label, key="range_end_month")
+            start_period, end_period = (start_year, int(start_month)), (end_year, int(end_month))
+        else:
+            target_year = st.selectbox("📅 Année", options=years, index=len(years)-2)  # Année précédente par défaut
+            start_period, end_period = (target_year, 1), (target_year, 12)
         
-        submit_button = st.form_submit_button(label="📥 Récupérer tous les bulletins de l'année")
+        max_workers = st.number_input(
+            "⚡ Requêtes simultanées", min_value=1, max_value=32, value=DEFAULT_MAX_WORKERS,
+            help="Nombre de collaborateurs interrogés en parallèle (1 = traitement séquentiel)",
+            key="yearly_max_workers"
+        )
+        
+        refresh_roster = st.checkbox(
+            "🔄 Recharger les collaborateurs et les listes de bulletins",
+            help="Ces listes sont gardées en cache quelques minutes ; cochez pour forcer un rechargement complet",
+            key="yearly_refresh_roster"
+        )
+        streaming_zip = st.checkbox(
+            "💾 Archive sur disque (mémoire limitée)",
+            help="Chaque bulletin est écrit dans le ZIP dès sa récupération puis libéré ; recommandé pour les grandes entreprises"
+        )
+        incremental = incremental_checkbox("yearly_incremental")
+        profile = profiling_checkbox("yearly_profile_run")
+        
+        default_compression = compression_policy_from_env().mode
+        compression = st.selectbox(
+            "🗜️ Compression du ZIP", options=COMPRESSION_MODES,
+            index=COMPRESSION_MODES.index(default_compression),
+            format_func=COMPRESSION_LABELS.get,
+            help="Les PDF sont déjà compressés : « Aucune » est la plus rapide pour un gain de taille souvent négligeable"
+        )
+        
+        submit_button = st.form_submit_button(
+            label="📥 Récupérer tous les bulletins de la période" if range_mode else "📥 Récupérer tous les bulletins de l'année",
+            disabled=st.session_state.yearly_job_id is not None,
+            on_click=take_api_key, args=("yearly_api_key_input", "yearly_api_key")
+        )
         
         if submit_button:
-            get_yearly_payslips(api_key, target_year)
-            del api_key
+            get_yearly_payslips(
+                st.session_state.yearly_api_key, start_period, end_period, int(max_workers), refresh_roster, streaming_zip, compression,
+                incremental, profile
+            )
+    
+    # Avancement de la tâche en cours, puis compte rendu de la dernière tâche
+    if st.session_state.yearly_job_id:
+        show_job_progress("yearly_job_id", "yearly_outcome", "Logs de traitement", 300, apply_yearly_result)
+    else:
+        show_job_outcome(st.session_state.yearly_outcome, "Logs de traitement", 300)
     
     # Affichage des résultats
     display_yearly_results()
@@ -766,7 +1062,7 @@ with st.expander("ℹ️ Guide d'utilisation", expanded=False):
     #### 📅 Onglet "Bulletins par mois"
     1. **Clé API** : Obtenez votre clé API depuis votre compte administrateur Payfit
     2. **Sélection de la période** : Choisissez l'année et le mois pour lesquels vous souhaitez récupérer les bulletins
-    3. **Lancement** : Cliquez sur le bouton pour commencer le processus
+    3. **Lancement** : Cliquez sur le bouton pour commencer le processus ; il se poursuit en arrière-plan et peut être annulé
     4. **Exploration des résultats** : Une fois le traitement terminé, vous pourrez :
        - Voir les informations détaillées de votre entreprise
        - Consulter la liste complète de vos collaborateurs
@@ -782,8 +1078,8 @@ with st.expander("ℹ️ Guide d'utilisation", expanded=False):
     ### 🔒 Sécurité
     
     - Les clés API sont automatiquement supprimées de la mémoire après utilisation
-    - Aucun stockage permanent des données sensibles
-    - Traitement entièrement en mémoire pour les PDF
+    - Aucun stockage permanent des données sensibles, sauf cache disque explicitement activé (`PAYSLIP_CACHE_DIR`, chiffré si `PAYSLIP_CACHE_KEY` est défini)
+    - Les PDF récupérés sont gardés dans des fichiers temporaires, supprimés quand la session expire
     """)
 
 # Pied de page
@@ -0,0 +1,127 @@
+"""Exécution des récupérations en tâche de fond, sans dépendance à Streamlit.
+
+Une tâche tourne dans un thread du moteur, indépendamment de l'exécution du
+script Streamlit : l'interface garde seulement l'identifiant de la tâche et
+interroge régulièrement son état, sa progression et son journal.
+"""
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from processing_log import ProcessingLog
+
+# États d'une tâche
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+# Tâches exécutées en même temps, toutes sessions confondues
+DEFAULT_JOB_WORKERS = 4
+# Durée pendant laquelle une tâche terminée mais jamais relue est gardée, en secondes ;
+# comme les résultats d'une session inactive, pour qu'un onglet reconnecté retrouve son export
+DEFAULT_JOB_RETENTION = 2 * 60 * 60
+# Avertissements et erreurs gardés par tâche
+MAX_JOB_MESSAGES = 200
+
+class JobError(Exception):
+    """Erreur prévue (clé invalide, etc.) : son message est affiché tel quel"""
+
+class JobCancelled(Exception):
+    """Levée par raise_if_cancelled quand l'annulation a été demandée"""
+
+class Job:
+    """État d'une tâche, mis à jour par la fonction qui s'exécute et lu par l'interface.
+
+    Niveaux des messages : "info", "success", "warning", "error".
+    """
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = JOB_PENDING
+        self.progress = 0  # 0 à 100
+        self.status = None  # (niveau, message) de l'étape en cours
+        self.messages = deque(maxlen=MAX_JOB_MESSAGES)  # [(niveau, message)]
+        self.log = ProcessingLog()
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def set_progress(self, value):
+        self.progress = max(0, min(100, int(value)))
+
+    def set_status(self, level, message):
+        self.status = (level, message)
+
+    def add_message(self, level, message):
+        self.messages.append((level, message))
+
+    def cancel(self):
+        self._cancel_requested.set()
+
+    def raise_if_cancelled(self):
+        if self._cancel_requested.is_set():
+            raise JobCancelled()
+
+class JobEngine:
+    """Pool de threads exécutant les tâches, avec un registre indexé par identifiant.
+
+    Les tâches terminées restent consultables jusqu'à ce que l'interface les
+    retire (pop) ou au plus retention secondes : un minuteur retire alors la
+    tâche et son résultat (ZIP, pages), même si plus rien n'est soumis.
+    """
+
+    def __init__(self, max_workers=DEFAULT_JOB_WORKERS, retention=DEFAULT_JOB_RETENTION):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}  # {identifiant: Job}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """Lance fn(job, *args, **kwargs) en tâche de fond ; son retour devient job.result"""
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.state = JOB_RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.state = JOB_DONE
+        except JobCancelled:
+            job.state = JOB_CANCELLED
+        except JobError as e:
+            job.error = str(e)
+            job.state = JOB_FAILED
+        except Exception as e:
+            job.error = f"Une erreur est survenue: {str(e)}"
+            job.traceback = traceback.format_exc()
+            job.state = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+            expiry = threading.Timer(self.retention, self.pop, args=(job.id,))
+            expiry.daemon = True
+            expiry.start()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pop(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
@@ -0,0 +1,663 @@
+"""Accès à l'API partenaire Payfit, sans dépendance à Streamlit"""
+import hashlib
+import ipaddress
+import json
+import math
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from secret_handle import SecretHandle
+
+# Adresses de l'API ; PAYFIT_API_URL et PAYFIT_OAUTH_URL les remplacent (serveur de test, benchmarks),
+# en https, ou en http seulement sur la machine locale
+BASE_URL = "https://partner-api.payfit.com"
+OAUTH_URL = "https://oauth.payfit.com"
+
+# Nombre d'appels simultanés par défaut pour les listes de bulletins
+DEFAULT_MAX_WORKERS = 8
+# Connexions gardées ouvertes par hôte
+DEFAULT_POOL_SIZE = 16
+
+# Débit initial et bornes du planificateur, en requêtes par seconde
+DEFAULT_RATE = 10.0
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 100.0
+# Tentatives par requête en cas de 429/5xx ou d'erreur de connexion
+DEFAULT_MAX_RETRIES = 6
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Attente maximale entre deux tentatives, en secondes, y compris celle demandée par Retry-After
+MAX_RETRY_DELAY = 30.0
+# Délais (connexion, lecture) en secondes : une socket bloquée devient une erreur réessayée
+DEFAULT_TIMEOUT = (5.0, 30.0)
+
+class RateLimiter:
+    """Seau à jetons adaptatif partagé par tous les clients d'une même clé API.
+
+    Le débit est divisé par deux quand l'API renvoie 429, avec une pause
+    globale de la durée Retry-After demandée, puis remonte de 10 % (au moins
+    increase_step) par tranche de increase_interval secondes sans 429 : la
+    reprise dépend du temps écoulé, pas du nombre de réponses, et reste
+    rapide même au débit plancher.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE,
+                 burst=None, increase_step=1.0, increase_interval=1.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst or max(1.0, rate)
+        self.increase_step = increase_step
+        self.increase_interval = increase_interval
+
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._last_change = self._last_refill
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Bloque jusqu'à ce qu'une requête puisse partir"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_change >= self.increase_interval:
+                self._last_change = now
+                self._refill(now)
+                self.rate = min(self.max_rate, self.rate + max(self.increase_step, self.rate * 0.1))
+                self.burst = max(self.burst, self.rate)
+
+    def on_throttle(self, delay=None):
+        """Ralentit après un 429 ; delay est la pause demandée par Retry-After"""
+        with self._lock:
+            now = time.monotonic()
+            self._last_change = now
+            # Plusieurs threads reçoivent souvent le même 429 : une seule baisse par seconde
+            if now - self._last_decrease >= 1.0:
+                self._refill(now)
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._last_decrease = now
+            if delay:
+                self._paused_until = max(self._paused_until, now + delay)
+                self._tokens = 0.0
+
+def rate_limiter_from_env():
+    """Planificateur avec le débit initial PAYFIT_RATE et le plafond PAYFIT_MAX_RATE (requêtes par seconde)"""
+    return RateLimiter(
+        rate=float(os.environ.get("PAYFIT_RATE") or DEFAULT_RATE),
+        max_rate=float(os.environ.get("PAYFIT_MAX_RATE") or DEFAULT_MAX_RATE)
+    )
+
+# Planificateurs par empreinte de clé API, gardés d'une récupération à l'autre ;
+# au-delà de MAX_RATE_LIMITERS clés, celui utilisé le moins récemment est oublié
+MAX_RATE_LIMITERS = 64
+_rate_limiters = OrderedDict()
+_rate_limiters_lock = threading.Lock()
+
+def shared_rate_limiter(key_fingerprint):
+    """Planificateur de la clé API : les tâches simultanées se partagent son débit, et une
+    nouvelle récupération repart du débit atteint par les précédentes"""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key_fingerprint)
+        if limiter is None:
+            limiter = _rate_limiters[key_fingerprint] = rate_limiter_from_env()
+            while len(_rate_limiters) > MAX_RATE_LIMITERS:
+                _rate_limiters.popitem(last=False)
+        else:
+            _rate_limiters.move_to_end(key_fingerprint)
+        return limiter
+
+def parse_retry_after(value, max_delay=MAX_RETRY_DELAY):
+    """Convertit un en-tête Retry-After (secondes ou date HTTP) en secondes, au plus max_delay.
+
+    Une valeur illisible ou non finie ("inf", "nan") est ignorée ; une date
+    sans fuseau horaire est lue en UTC.
+    """
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    if not math.isfinite(delay):
+        return None
+    return min(max_delay, max(0.0, delay))
+
+def checked_api_url(url):
+    """Renvoie url si la clé API peut y être envoyée : https, ou http vers la boucle locale"""
+    parts = urlsplit(url)
+    if parts.scheme == "https" and parts.hostname:
+        return url
+    if parts.scheme == "http" and parts.hostname:
+        if parts.hostname == "localhost":
+            return url
+        try:
+            if ipaddress.ip_address(parts.hostname).is_loopback:
+                return url
+        except ValueError:
+            pass
+    raise ValueError(f"Adresse d'API refusée : {url!r} (https requis, http seulement vers localhost)")
+
+class PayfitClient:
+    """Client de l'API Payfit : une session HTTP partagée, avec pool de connexions keep-alive.
+
+    La session peut être utilisée depuis plusieurs threads ; pool_size doit
+    être au moins égal au nombre d'appels simultanés pour que chaque thread
+    réutilise une connexion déjà ouverte. Avec metrics (run_metrics.RunMetrics),
+    chaque tentative est mesurée dans l'étape de la requête.
+
+    api_key peut être une chaîne ou une SecretHandle : le client s'y
+    enregistre comme détenteur d'une copie, qu'il oublie à sa fermeture ou
+    quand la clé est effacée. Sans rate_limiter, le client utilise le
+    planificateur partagé de sa clé (shared_rate_limiter).
+    """
+
+    def __init__(self, api_key, pool_size=DEFAULT_POOL_SIZE, keep_alive=True, headers=None,
+                 base_url=None, oauth_url=None, rate_limiter=None, max_retries=DEFAULT_MAX_RETRIES, metrics=None,
+                 timeout=DEFAULT_TIMEOUT):
+        # Vérifiées avant toute copie de la clé : une adresse refusée ne laisse rien derrière elle
+        self.base_url = checked_api_url(base_url or os.environ.get("PAYFIT_API_URL") or BASE_URL)
+        self.oauth_url = checked_api_url(oauth_url or os.environ.get("PAYFIT_OAUTH_URL") or OAUTH_URL)
+        if isinstance(api_key, SecretHandle):
+            self._secret = api_key
+            self.key_fingerprint = api_key.fingerprint
+            api_key = api_key.reveal()
+            self._secret.attach(self)
+        else:
+            self._secret = None
+            self.key_fingerprint = hashlib.sha256(api_key.encode()).hexdigest()
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter or shared_rate_limiter(self.key_fingerprint)
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {api_key}',
+            'Connection': 'keep-alive' if keep_alive else 'close'
+        })
+        if headers:
+            self.session.headers.update(headers)
+
+    def wipe_secret(self):
+        """Oublie la copie de la clé (en-tête compris) ; le client ne peut plus appeler l'API"""
+        self.api_key = None
+        self.session.headers.pop('Authorization', None)
+
+    def close(self):
+        self.session.close()
+        self.wipe_secret()
+        if self._secret is not None:
+            self._secret.detach(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _observe(self, stage, start, response=None, stream=False):
+        """Mesure une tentative : durée jusqu'à la réponse (en-têtes seulement en mode stream) et octets lus"""
+        if self.metrics is None:
+            return
+        failed = response is None or response.status_code >= 400
+        nbytes = 0 if response is None or stream else len(response.content)
+        self.metrics.observe(stage, time.perf_counter() - start, nbytes, error=failed)
+
+    def request(self, method, url, stage="other", **kwargs):
+        """Envoie une requête en respectant le débit autorisé.
+
+        Les réponses 429/5xx et les erreurs de connexion sont réessayées après
+        la pause Retry-After (ou un délai exponentiel) ; après max_retries
+        tentatives la dernière réponse est renvoyée telle quelle. `stage` est
+        l'étape où la requête est comptée dans metrics. Sans timeout explicite,
+        celui du client s'applique.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            last_attempt = attempt == self.max_retries
+            backoff = min(MAX_RETRY_DELAY, 0.5 * 2 ** attempt) * (0.5 + random.random())
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._observe(stage, start)
+                if last_attempt:
+                    raise
+                if self.metrics is not None:
+                    self.metrics.add_retry(stage)
+                time.sleep(backoff)
+                continue
+            self._observe(stage, start, response, kwargs.get("stream", False))
+
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                self.rate_limiter.on_success()
+                return response
+
+            delay = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code == 429:
+                # Limite de débit atteinte : toutes les requêtes de la clé ralentissent,
+                # y compris quand celle-ci n'est plus réessayée
+                self.rate_limiter.on_throttle(delay if delay is not None else backoff)
+            if last_attempt:
+                return response
+            response.close()
+            if self.metrics is not None:
+                self.metrics.add_retry(stage)
+            if response.status_code != 429:
+                # Erreur serveur : seule cette requête attend avant de réessayer
+                time.sleep(delay if delay is not None else backoff)
+
+    def get(self, path, stage="other", **kwargs):
+        return self.request("GET", f"{self.base_url}{path}", stage, **kwargs)
+
+    def introspect(self):
+        """Vérifie la clé API auprès du serveur OAuth"""
+        resp = self.request(
+            "POST",
+            f"{self.oauth_url}/introspect",
+            "introspect",
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps({"token": self.api_key})
+        )
+        return resp.json()
+
+    def get_company(self, company_id):
+        return self.get(f"/companies/{company_id}", "company").json()
+
+    def get_collaborators_page(self, company_id, next_page_token=None, headers=None):
+        params = {"nextPageToken": next_page_token} if next_page_token else {}
+        return self.get(f"/companies/{company_id}/collaborators", "roster", params=params, headers=headers)
+
+    def get_payslip_listing(self, company_id, collaborator_id):
+        """Récupère la liste de tous les bulletins d'un collaborateur"""
+        return self.get(f"/companies/{company_id}/collaborators/{collaborator_id}/payslips/", "listings").json()
+
+    def get_payslip_pdf(self, company_id, collaborator_id, contract_id, payslip_id, stream=False):
+        return self.get(
+            f"/companies/{company_id}/collaborators/{collaborator_id}/contracts/{contract_id}/payslips/{payslip_id}",
+            "download",
+            headers={'accept': 'application/pdf'},
+            stream=stream
+        )
+
+# Durée de validité d'une introspection quand la réponse ne donne pas "exp", en secondes
+DEFAULT_INTROSPECT_TTL = 5 * 60
+
+class IntrospectionCache:
+    """Résultats de /introspect indexés par empreinte SHA-256 de la clé API.
+
+    Seules les clés actives sont gardées, jusqu'à l'expiration du jeton
+    ("exp") ; la clé elle-même n'est jamais stockée.
+    """
+
+    def __init__(self, default_ttl=DEFAULT_INTROSPECT_TTL):
+        self.default_ttl = default_ttl
+        self._results = {}  # {empreinte de la clé: (réponse, expiration en temps epoch)}
+        self._lock = threading.Lock()
+
+    def introspect(self, client):
+        key_hash = client.key_fingerprint
+        with self._lock:
+            cached = self._results.get(key_hash)
+        if cached and time.time() < cached[1]:
+            return cached[0]
+
+        data = client.introspect()
+        if data.get("active"):
+            expires_at = data.get("exp") or time.time() + self.default_ttl
+            with self._lock:
+                self._results[key_hash] = (data, float(expires_at))
+        else:
+            with self._lock:
+                self._results.pop(key_hash, None)
+        return data
+
+# Durée de validité par défaut de la liste des collaborateurs, en secondes
+DEFAULT_ROSTER_TTL = 15 * 60
+
+class RosterCache:
+    """Liste des collaborateurs de chaque entreprise, gardée ttl secondes.
+
+    À l'expiration, chaque page est revalidée avec If-None-Match /
+    If-Modified-Since quand l'API a fourni un ETag ou un Last-Modified : une
+    page inchangée (304) est reprise telle quelle, seules les pages modifiées
+    sont retéléchargées. Un rafraîchissement forcé refait le parcours complet.
+    """
+
+    def __init__(self, ttl=DEFAULT_ROSTER_TTL):
+        self.ttl = ttl
+        self._rosters = {}  # {company_id: {"pages": [...], "collaborators": [...], "fetched_at": ...}}
+        self._company_locks = {}
+        self._lock = threading.Lock()
+
+    def _company_lock(self, company_id):
+        with self._lock:
+            return self._company_locks.setdefault(company_id, threading.Lock())
+
+    def get_collaborators(self, client, company_id, force_refresh=False, on_page=None):
+        """Renvoie (collaborateurs, code d'erreur ou None).
+
+        on_page(numéro de page, nombre de collaborateurs jusqu'ici) est appelé
+        après chaque page. Une liste interrompue par une erreur est renvoyée
+        partiellement, comme avant, mais n'est pas mise en cache.
+        """
+        with self._company_lock(company_id):
+            entry = self._rosters.get(company_id)
+            if entry and not force_refresh and time.monotonic() - entry["fetched_at"] < self.ttl:
+                return entry["collaborators"], None
+
+            old_pages = entry["pages"] if entry and not force_refresh else []
+            pages = []
+            all_collabs = []
+            next_page_token = None
+
+            while True:
+                old_page = old_pages[len(pages)] if len(pages) < len(old_pages) else None
+                if old_page and old_page["token"] != next_page_token:
+                    old_page = None
+
+                conditional_headers = {}
+                if old_page and old_page.get("etag"):
+                    conditional_headers['If-None-Match'] = old_page["etag"]
+                if old_page and old_page.get("last_modified"):
+                    conditional_headers['If-Modified-Since'] = old_page["last_modified"]
+
+                response = client.get_collaborators_page(company_id, next_page_token, headers=conditional_headers or None)
+
+                if response.status_code == 304 and old_page:
+                    page = old_page
+                elif response.status_code == 200:
+                    collabs_response = response.json()
+                    page = {
+                        "token": next_page_token,
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "collaborators": collabs_response.get("collaborators", []),
+                        "next": collabs_response.get("meta", {}).get("nextPageToken")
+                    }
+                else:
+                    return all_collabs, response.status_code
+
+                pages.append(page)
+                all_collabs.extend(page["collaborators"])
+                if on_page:
+                    on_page(len(pages), len(all_collabs))
+
+                next_page_token = page["next"]
+                if not next_page_token:
+                    break
+
+            self._rosters[company_id] = {
+                "pages": pages,
+                "collaborators": all_collabs,
+                "fetched_at": time.monotonic()
+            }
+            return all_collabs, None
+
+# Durée de validité par défaut des listes de bulletins indexées, en secondes
+DEFAULT_PAYSLIP_INDEX_TTL = 15 * 60
+
+class PayslipIndex:
+    """Index des bulletins de chaque entreprise par (collaborateur, année, mois).
+
+    Rempli par les appels de liste, il répond ensuite aux recherches par mois
+    ou par période sans rappeler l'API tant que la liste d'un collaborateur a
+    moins de ttl secondes.
+    """
+
+    def __init__(self, ttl=DEFAULT_PAYSLIP_INDEX_TTL):
+        self.ttl = ttl
+        # {company_id: {collaborator_id: {"payslips": [...], "by_period": {(année, mois): [...]}, "fetched_at": ...}}}
+        self._companies = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, company_id, collaborator_id):
+        with self._lock:
+            return self._companies.get(company_id, {}).get(collaborator_id)
+
+    def _store(self, company_id, collaborator_id, payslips):
+        by_period = {}
+        for payslip in payslips:
+            year, month = int(payslip["year"]), int(payslip["month"])
+            by_period.setdefault((year, month), []).append(payslip)
+        entry = {
+            "payslips": payslips,
+            "by_period": by_period,
+            "fetched_at": time.monotonic()
+        }
+        with self._lock:
+            self._companies.setdefault(company_id, {})[collaborator_id] = entry
+        return entry
+
+    def load(self, client, company_id, collabs, max_workers=DEFAULT_MAX_WORKERS, force_refresh=False):
+        """Renvoie au fil de l'eau la liste des bulletins de chaque collaborateur, dans l'ordre.
+
+        Seuls les collaborateurs absents de l'index (ou dont la liste a
+        expiré) sont interrogés, en parallèle. Une réponse sans clé
+        "payslips" compte comme une liste vide et n'est pas indexée.
+        """
+        now = time.monotonic()
+        entries = []  # Entrée encore valide, ou None s'il faut rappeler l'API
+        for collab in collabs:
+            entry = None if force_refresh else self._entry(company_id, collab["id"])
+            entries.append(entry if entry and now - entry["fetched_at"] < self.ttl else None)
+
+        to_fetch = [collab for collab, entry in zip(collabs, entries) if entry is None]
+        listings = fetch_payslip_listings(client, company_id, to_fetch, max_workers)
+
+        for collab, entry in zip(collabs, entries):
+            if entry is not None:
+                yield entry["payslips"]
+                continue
+            payslip_resp = next(listings)
+            if "payslips" in payslip_resp:
+                self._store(company_id, collab["id"], payslip_resp["payslips"] or [])
+            yield payslip_resp.get("payslips") or []
+
+    def find(self, company_id, collaborator_id, year, month):
+        """Bulletins d'un collaborateur pour un mois donné"""
+        entry = self._entry(company_id, collaborator_id)
+        return list(entry["by_period"].get((int(year), int(month)), [])) if entry else []
+
+    def for_range(self, company_id, collaborator_id, start, end):
+        """Bulletins d'un collaborateur entre deux périodes (année, mois) incluses, dans l'ordre de la liste Payfit"""
+        entry = self._entry(company_id, collaborator_id)
+        if not entry:
+            return []
+        return [
+            payslip for payslip in entry["payslips"]
+            if tuple(start) <= (int(payslip["year"]), int(payslip["month"])) <= tuple(end)
+        ]
+
+def fetch_payslip_listings(client, company_id, collabs, max_workers=DEFAULT_MAX_WORKERS):
+    """Récupère les listes de bulletins de plusieurs collaborateurs en parallèle.
+
+    Les réponses sont renvoyées au fil de l'eau dans l'ordre de `collabs`,
+    quel que soit l'ordre d'arrivée. Avec max_workers <= 1 les appels restent
+    séquentiels, comme avant.
+    """
+    collaborator_ids = [collab["id"] for collab in collabs]
+
+    if max_workers <= 1:
+        for collaborator_id in collaborator_ids:
+            yield client.get_payslip_listing(company_id, collaborator_id)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(
+            lambda collaborator_id: client.get_payslip_listing(company_id, collaborator_id),
+            collaborator_ids
+        )
+
+# Limites par défaut de l'étape de téléchargement des PDF
+DEFAULT_DOWNLOAD_WORKERS = 16
+DEFAULT_MAX_INFLIGHT_BYTES = 64 * 1024 * 1024
+# Taille supposée d'un PDF quand la réponse n'annonce pas de Content-Length
+ESTIMATED_PDF_SIZE = 512 * 1024
+
+class ByteBudget:
+    """Budget d'octets partagé entre threads, pour borner la mémoire occupée par les PDF"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.used = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        # Un PDF plus gros que le budget passe quand plus rien d'autre n'est réservé
+        with self._condition:
+            while not self.closed and self.used > 0 and self.used + nbytes > self.capacity:
+                self._condition.wait()
+            self.used += nbytes
+
+    def force_acquire(self, nbytes):
+        with self._condition:
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+def _download_payslip_pdf(client, company_id, job, budget):
+    response = client.get_payslip_pdf(
+        company_id, job["collaborator_id"], job["contract_id"], job["payslip_id"], stream=True
+    )
+    with response:
+        if response.status_code != 200:
+            return job, response.status_code, None, 0
+
+        # Réservation avant de lire le corps de la réponse
+        reserved = int(response.headers.get("Content-Length") or ESTIMATED_PDF_SIZE)
+        budget.acquire(reserved)
+        try:
+            content = response.content
+        except Exception:
+            budget.release(reserved)
+            raise
+        if len(content) > reserved:
+            budget.force_acquire(len(content) - reserved)
+            reserved = len(content)
+        if client.metrics is not None:
+            # Corps lu hors de request en mode stream
+            client.metrics.add_bytes("download", len(content))
+        return job, response.status_code, content, reserved
+
+def download_payslip_pdfs(client, company_id, jobs, max_workers=DEFAULT_DOWNLOAD_WORKERS,
+                          max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES, max_pending=None, stop=None):
+    """Télécharge les PDF de bulletins en parallèle.
+
+    Chaque job est un dict contenant au moins collaborator_id, contract_id et
+    payslip_id. Les résultats (job, status_code, content) sont renvoyés dans
+    l'ordre d'arrivée. Au plus max_workers requêtes sont ouvertes en même
+    temps, et les PDF reçus mais pas encore traités par l'appelant occupent au
+    plus max_inflight_bytes : la mémoire d'un PDF est rendue quand l'appelant
+    demande le résultat suivant.
+
+    `jobs` peut être un générateur lent (étape précédente d'un pipeline) : il
+    est lu dans un thread à part, au plus max_pending téléchargements
+    d'avance, pendant que les résultats déjà arrivés sont renvoyés. Quand
+    l'appelant arrête de lire (exception, générateur fermé), l'événement
+    `stop` est levé : le générateur de jobs peut le consulter entre deux
+    listes pour s'interrompre, et le thread qui le lit est attendu avant de
+    rendre la main, pour ne plus appeler l'API avec un client déjà fermé.
+    """
+    max_workers = max(1, max_workers)
+    max_pending = max_pending or 4 * max_workers
+    budget = ByteBudget(max_inflight_bytes)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    slots = threading.Semaphore(max_pending)  # Téléchargements lancés mais pas encore rendus à l'appelant
+    results = queue.Queue()  # Futures terminés, puis ("end", nombre de jobs) ou l'exception du lecteur de jobs
+    stopped = stop or threading.Event()
+
+    def feed():
+        submitted = 0
+        try:
+            for job in jobs:
+                while not slots.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        return
+                if stopped.is_set():
+                    return
+                future = executor.submit(_download_payslip_pdf, client, company_id, job, budget)
+                future.add_done_callback(results.put)
+                submitted += 1
+        except BaseException as e:
+            results.put(e)
+        finally:
+            if stopped.is_set() and hasattr(jobs, "close"):
+                # Annule les listes encore en attente dans l'étape précédente
+                jobs.close()
+            results.put(("end", submitted))
+
+    feeder = threading.Thread(target=feed, name="payslip-jobs", daemon=True)
+    feeder.start()
+    try:
+        received, total = 0, None
+        while total is None or received < total:
+            item = results.get()
+            if isinstance(item, BaseException):
+                raise item
+            if isinstance(item, tuple):
+                total = item[1]
+                continue
+            received += 1
+            job, status_code, content, reserved = item.result()
+            # Aucune référence gardée sur le future, pour que le PDF puisse être libéré
+            del item
+            slots.release()
+            try:
+                yield job, status_code, content
+            finally:
+                del content
+                budget.release(reserved)
+    finally:
+        stopped.set()
+        feeder.join()
+        budget.close()
+        executor.shutdown(wait=True, cancel_futures=True)
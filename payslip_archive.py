@@ -0,0 +1,318 @@
+"""Construction des archives ZIP de bulletins, sans dépendance à Streamlit.
+
+La compression de chaque fichier (zlib, qui libère le GIL) peut être confiée
+à un pool de threads ; ZipWriter écrit ensuite les fichiers déjà compressés
+en une seule passe, répertoire central compris.
+"""
+import io
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Taille au-delà de laquelle une archive en cours quitte la mémoire pour un fichier temporaire
+DEFAULT_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Politiques de compression : "stored" copie les PDF tels quels, "deflate" les
+# recompresse, "auto" ne compresse que les fichiers dont un échantillon gagne assez
+COMPRESSION_STORED = "stored"
+COMPRESSION_DEFLATE = "deflate"
+COMPRESSION_AUTO = "auto"
+COMPRESSION_MODES = (COMPRESSION_AUTO, COMPRESSION_STORED, COMPRESSION_DEFLATE)
+DEFAULT_COMPRESSION = COMPRESSION_AUTO
+DEFAULT_DEFLATE_LEVEL = 6
+
+# Fichiers compressés en avance par fichier écrit, quand un pool est utilisé
+PENDING_ENTRIES_PER_WORKER = 4
+
+# Échantillonnage du mode "auto" : quelques tranches réparties dans le fichier,
+# compressées au niveau 1, doivent gagner au moins AUTO_MIN_SAVING
+AUTO_SAMPLE_SLICES = 4
+AUTO_SAMPLE_SLICE_SIZE = 4 * 1024
+AUTO_MIN_SAVING = 0.10
+
+class CompressionPolicy:
+    """Choix de la compression de chaque fichier ajouté à une archive.
+
+    Les flux des PDF sont déjà compressés (Flate) : les recompresser coûte du
+    CPU pour un gain souvent nul, d'où le mode "auto" par défaut.
+    """
+
+    def __init__(self, mode=DEFAULT_COMPRESSION, level=DEFAULT_DEFLATE_LEVEL):
+        if mode not in COMPRESSION_MODES:
+            raise ValueError(f"Compression inconnue : {mode} (attendu : {', '.join(COMPRESSION_MODES)})")
+        self.mode = mode
+        self.level = level
+
+    def _sample(self, content):
+        if len(content) <= AUTO_SAMPLE_SLICES * AUTO_SAMPLE_SLICE_SIZE:
+            return content
+        step = (len(content) - AUTO_SAMPLE_SLICE_SIZE) // (AUTO_SAMPLE_SLICES - 1)
+        return b"".join(content[i * step:i * step + AUTO_SAMPLE_SLICE_SIZE] for i in range(AUTO_SAMPLE_SLICES))
+
+    def choose(self, content):
+        """Renvoie (compress_type, compresslevel) pour ce contenu"""
+        if self.mode == COMPRESSION_STORED or not content:
+            return zipfile.ZIP_STORED, None
+        if self.mode == COMPRESSION_AUTO:
+            sample = self._sample(content)
+            if len(zlib.compress(sample, 1)) > len(sample) * (1 - AUTO_MIN_SAVING):
+                return zipfile.ZIP_STORED, None
+        return zipfile.ZIP_DEFLATED, self.level
+
+    def __repr__(self):
+        if self.mode == COMPRESSION_STORED:
+            return self.mode
+        return f"{self.mode} (niveau {self.level})"
+
+def compression_policy_from_env(mode=None):
+    """Politique de compression ; par défaut ZIP_COMPRESSION et ZIP_DEFLATE_LEVEL"""
+    return CompressionPolicy(
+        mode or os.environ.get("ZIP_COMPRESSION") or DEFAULT_COMPRESSION,
+        int(os.environ.get("ZIP_DEFLATE_LEVEL") or DEFAULT_DEFLATE_LEVEL)
+    )
+
+def new_archive_stats():
+    """Statistiques de construction d'une archive"""
+    return {"entries": 0, "stored": 0, "deflated": 0, "input_bytes": 0, "output_bytes": 0, "build_seconds": 0.0}
+
+def compress_entry(content, policy):
+    """Compresse un fichier selon la politique ; renvoie (méthode, crc32, données, taille d'origine).
+
+    Sans état partagé : peut tourner dans n'importe quel thread du pool.
+    """
+    compress_type, compresslevel = policy.choose(content)
+    crc = zlib.crc32(content)
+    if compress_type == zipfile.ZIP_STORED:
+        return compress_type, crc, content, len(content)
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)  # Flux deflate brut, sans en-tête zlib
+    return compress_type, crc, compressor.compress(content) + compressor.flush(), len(content)
+
+# Structures du format ZIP (APPNOTE), toutes en petit-boutiste
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+ZIP64_END_RECORD = struct.Struct("<IQHHIIQQQQ")
+ZIP64_END_LOCATOR = struct.Struct("<IIQI")
+UTF8_FLAG = 0x800
+
+class ZipWriter:
+    """Écrit dans un fichier une archive ZIP à partir de fichiers déjà compressés.
+
+    Les tailles et le CRC étant connus avant l'écriture, chaque fichier est
+    écrit d'un seul tenant (sans descripteur de données) ; les extensions
+    Zip64 sont ajoutées au-delà de 4 Go ou de 65535 fichiers.
+    """
+
+    def __init__(self, fileobj, stats=None):
+        self._file = fileobj
+        self._offset = fileobj.tell()
+        self._central_directory = []
+        self.stats = stats if stats is not None else new_archive_stats()
+        year, month, day, hour, minute, second = time.localtime()[:6]
+        self._dos_date = (year - 1980) << 9 | month << 5 | day
+        self._dos_time = hour << 11 | minute << 5 | second // 2
+
+    @staticmethod
+    def _encode_name(path_in_zip):
+        try:
+            return path_in_zip.encode("ascii"), 0
+        except UnicodeEncodeError:
+            return path_in_zip.encode("utf-8"), UTF8_FLAG
+
+    def write(self, path_in_zip, entry):
+        """Ajoute un fichier compressé par compress_entry"""
+        method, crc, data, size = entry
+        name, flags = self._encode_name(path_in_zip)
+        zip64_sizes = size >= ZIP64_LIMIT or len(data) >= ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 1, 16, size, len(data)) if zip64_sizes else b""
+        version = 45 if zip64_sizes else 20
+        header = LOCAL_HEADER.pack(
+            0x04034b50, version, flags, method, self._dos_time, self._dos_date, crc,
+            ZIP64_LIMIT if zip64_sizes else len(data), ZIP64_LIMIT if zip64_sizes else size,
+            len(name), len(extra)
+        )
+        self._file.write(header + name + extra)
+        self._file.write(data)
+        self._central_directory.append((name, flags, method, crc, len(data), size, self._offset))
+        self._offset += len(header) + len(name) + len(extra) + len(data)
+
+        self.stats["entries"] += 1
+        self.stats["stored" if method == zipfile.ZIP_STORED else "deflated"] += 1
+        self.stats["input_bytes"] += size
+
+    def close(self):
+        """Écrit le répertoire central et l'enregistrement de fin"""
+        directory_offset = self._offset
+        for name, flags, method, crc, compressed_size, size, offset in self._central_directory:
+            zip64_fields = [value for value in (size, compressed_size, offset) if value >= ZIP64_LIMIT]
+            extra = struct.pack(f"<HH{len(zip64_fields)}Q", 1, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b""
+            version = 45 if zip64_fields else 20
+            header = CENTRAL_HEADER.pack(
+                0x02014b50, version, version, flags, method, self._dos_time, self._dos_date, crc,
+                min(compressed_size, ZIP64_LIMIT), min(size, ZIP64_LIMIT), len(name), len(extra), 0, 0, 0,
+                0o600 << 16, min(offset, ZIP64_LIMIT)
+            )
+            self._file.write(header + name + extra)
+            self._offset += len(header) + len(name) + len(extra)
+        directory_size = self._offset - directory_offset
+        count = len(self._central_directory)
+
+        if count > ZIP_MAX_ENTRIES or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+            self._file.write(ZIP64_END_RECORD.pack(
+                0x06064b50, ZIP64_END_RECORD.size - 12, 45, 45, 0, 0, count, count, directory_size, directory_offset
+            ))
+            self._file.write(ZIP64_END_LOCATOR.pack(0x07064b50, 0, self._offset, 1))
+            self._offset += ZIP64_END_RECORD.size + ZIP64_END_LOCATOR.size
+        self._file.write(END_RECORD.pack(
+            0x06054b50, 0, 0, min(count, ZIP_MAX_ENTRIES), min(count, ZIP_MAX_ENTRIES),
+            min(directory_size, ZIP64_LIMIT), min(directory_offset, ZIP64_LIMIT), 0
+        ))
+        self._offset += END_RECORD.size
+        self.stats["output_bytes"] = self._offset
+
+def create_archive_pool(max_workers=None):
+    """Pool de threads pour la compression : zlib libère le GIL, les threads suffisent"""
+    return ThreadPoolExecutor(max_workers=max_workers or os.cpu_count(), thread_name_prefix="zip")
+
+def compress_entries(entries, policy, executor=None, max_pending=None):
+    """Compresse des (chemin, contenu) et renvoie des (chemin, fichier compressé) dans le même ordre.
+
+    Avec un executor, au plus max_pending fichiers sont compressés en avance
+    pour borner la mémoire.
+    """
+    if executor is None:
+        for path_in_zip, content in entries:
+            yield path_in_zip, compress_entry(content, policy)
+        return
+
+    max_pending = max_pending or PENDING_ENTRIES_PER_WORKER * (os.cpu_count() or 1)
+    pending = deque()
+    for path_in_zip, content in entries:
+        pending.append((path_in_zip, executor.submit(compress_entry, content, policy)))
+        while len(pending) >= max_pending or (pending and pending[0][1].done()):
+            path_in_zip, future = pending.popleft()
+            yield path_in_zip, future.result()
+    while pending:
+        path_in_zip, future = pending.popleft()
+        yield path_in_zip, future.result()
+
+def build_zip(entries, policy=None, executor=None):
+    """Construit une archive en mémoire à partir de (chemin, contenu) ; renvoie (contenu, statistiques)"""
+    policy = policy or CompressionPolicy()
+    start = time.perf_counter()
+    zip_buffer = io.BytesIO()
+    writer = ZipWriter(zip_buffer)
+    for path_in_zip, entry in compress_entries(entries, policy, executor):
+        writer.write(path_in_zip, entry)
+    writer.close()
+    writer.stats["build_seconds"] = time.perf_counter() - start
+    return zip_buffer.getvalue(), writer.stats
+
+class StreamingZipArchive:
+    """Archive ZIP écrite au fil de l'eau dans un fichier temporaire.
+
+    Chaque bulletin est écrit dès qu'il est prêt et peut être libéré
+    aussitôt : la mémoire occupée ne dépend plus du nombre de bulletins. Le
+    fichier reste en mémoire tant qu'il fait moins de spool_max_size, puis
+    passe sur disque ; il est supprimé à la fermeture de l'archive ou quand
+    l'objet est libéré. `stats` cumule le temps passé à écrire l'archive.
+
+    Avec un executor, la compression se fait dans le pool et les fichiers sont
+    écrits dans l'ordre où leur compression se termine.
+    """
+
+    def __init__(self, policy=None, spool_max_size=DEFAULT_SPOOL_MAX_SIZE, executor=None, max_pending=None):
+        self.policy = policy or CompressionPolicy()
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+        self._writer = ZipWriter(self._file)
+        self._executor = executor
+        self._max_pending = max_pending or PENDING_ENTRIES_PER_WORKER * (os.cpu_count() or 1)
+        self._pending = {}  # {future: chemin dans le ZIP}
+        self._lock = threading.Lock()
+        self.stats = self._writer.stats
+
+    @property
+    def entry_count(self):
+        return self.stats["entries"]
+
+    def _write_completed(self, block):
+        """Écrit les fichiers dont la compression est terminée (appelé sous le verrou)"""
+        if block:
+            done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+        else:
+            done = [future for future in self._pending if future.done()]
+        for future in done:
+            self._writer.write(self._pending.pop(future), future.result())
+
+    def add(self, path_in_zip, content):
+        with self._lock:
+            start = time.perf_counter()
+            if self._executor is None:
+                self._writer.write(path_in_zip, compress_entry(content, self.policy))
+            else:
+                self._pending[self._executor.submit(compress_entry, content, self.policy)] = path_in_zip
+                self._write_completed(block=False)
+                while len(self._pending) >= self._max_pending:
+                    self._write_completed(block=True)
+            self.stats["build_seconds"] += time.perf_counter() - start
+
+    def finish(self):
+        """Écrit le répertoire central ; l'archive ne peut plus recevoir de bulletins"""
+        with self._lock:
+            if self._writer is not None:
+                start = time.perf_counter()
+                while self._pending:
+                    self._write_completed(block=True)
+                self._writer.close()
+                self._writer = None
+                self.stats["build_seconds"] += time.perf_counter() - start
+
+    @property
+    def size(self):
+        with self._lock:
+            self._file.seek(0, io.SEEK_END)
+            return self._file.tell()
+
+    def read(self):
+        """Contenu complet de l'archive (à appeler après finish)"""
+        with self._lock:
+            self._file.seek(0)
+            return self._file.read()
+
+    def copy_to(self, fileobj):
+        """Copie l'archive dans un fichier ouvert, sans la charger entièrement en mémoire"""
+        with self._lock:
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, fileobj)
+
+    def extract_all(self, directory):
+        """Écrit chaque bulletin de l'archive dans directory, en gardant l'arborescence du ZIP"""
+        with self._lock:
+            self._file.seek(0)
+            with zipfile.ZipFile(self._file, 'r') as source:
+                source.extractall(directory)
+
+    def read_subset(self, paths_in_zip):
+        """Nouvelle archive contenant seulement certains fichiers, renommés à la racine"""
+        output = io.BytesIO()
+        with self._lock:
+            self._file.seek(0)
+            with zipfile.ZipFile(self._file, 'r') as source:
+                writer = ZipWriter(output)
+                for path_in_zip in paths_in_zip:
+                    writer.write(path_in_zip.rsplit('/', 1)[-1], compress_entry(source.read(path_in_zip), self.policy))
+                writer.close()
+        return output.getvalue()
+
+    def close(self):
+        self.finish()
+        self._file.close()
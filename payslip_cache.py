@@ -0,0 +1,167 @@
+"""Cache disque des bulletins de paie déjà téléchargés.
+
+Un bulletin identifié par (collaborator_id, contract_id, payslip_id) ne change
+plus une fois émis : le PDF brut et la 2ème page extraite sont gardés sur
+disque, avec un budget en octets et une éviction LRU. Un bulletin qui n'a
+qu'une page est marqué comme tel, pour ne pas retenter l'extraction.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # Chiffrement optionnel
+    Fernet = None
+
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Préfixe des fichiers en cours d'écriture, et âge au-delà duquel l'écriture est
+# considérée comme interrompue (un autre processus peut partager le dossier)
+TMP_PREFIX = ".tmp-"
+STALE_TMP_SECONDS = 60 * 60
+
+# Contenus stockés pour chaque bulletin
+KIND_PDF = "pdf"
+KIND_PAGE = "page2"
+KIND_SINGLE_PAGE = "single"  # Marqueur vide : pas de 2ème page
+
+class PayslipCache:
+    """Cache LRU des bulletins, borné à max_bytes sur disque.
+
+    Si encryption_key est fournie (clé Fernet), les fichiers sont chiffrés ;
+    le paquet `cryptography` est alors nécessaire.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_MAX_BYTES, encryption_key=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._fernet = None
+        if encryption_key:
+            if Fernet is None:
+                raise RuntimeError("Le paquet 'cryptography' est nécessaire pour chiffrer le cache")
+            self._fernet = Fernet(encryption_key)
+
+        self._entries = OrderedDict()  # {nom de fichier: taille}, du moins au plus récent
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        files = []
+        stale_before = time.time() - STALE_TMP_SECONDS
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.startswith(TMP_PREFIX):
+                # Écriture interrompue (arrêt brutal) : le fichier n'entre pas dans le budget, il est supprimé
+                try:
+                    if entry.stat().st_mtime < stale_before:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+            elif entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+        # Le budget a pu être réduit depuis le dernier lancement
+        self._evict()
+
+    @staticmethod
+    def _file_name(collaborator_id, contract_id, payslip_id, kind):
+        digest = hashlib.sha256(f"{collaborator_id}/{contract_id}/{payslip_id}".encode()).hexdigest()
+        return f"{digest}.{kind}"
+
+    def _get(self, file_name):
+        with self._lock:
+            if file_name not in self._entries:
+                return None
+            self._entries.move_to_end(file_name)
+        path = os.path.join(self.directory, file_name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self._forget(file_name)
+            return None
+        if self._fernet:
+            try:
+                data = self._fernet.decrypt(data)
+            except InvalidToken:
+                # Fichier écrit avec une autre clé : on le traite comme absent
+                self._forget(file_name)
+                return None
+        return data
+
+    def _put(self, file_name, data):
+        if self._fernet:
+            data = self._fernet.encrypt(data)
+        # Écriture atomique : un fichier partiel n'est jamais visible dans le cache
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=TMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.directory, file_name))
+        except OSError:
+            # Le cache n'est qu'une optimisation : une écriture ratée est ignorée
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(file_name, 0)
+            self._entries[file_name] = len(data)
+        self._evict()
+
+    def _evict(self):
+        """Supprime les fichiers les moins récemment utilisés jusqu'à respecter le budget"""
+        evicted = []
+        with self._lock:
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                name, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _forget(self, file_name):
+        with self._lock:
+            self._total_bytes -= self._entries.pop(file_name, 0)
+        try:
+            os.remove(os.path.join(self.directory, file_name))
+        except OSError:
+            pass
+
+    def get_pdf(self, collaborator_id, contract_id, payslip_id):
+        return self._get(self._file_name(collaborator_id, contract_id, payslip_id, KIND_PDF))
+
+    def get_page(self, collaborator_id, contract_id, payslip_id):
+        return self._get(self._file_name(collaborator_id, contract_id, payslip_id, KIND_PAGE))
+
+    def is_single_page(self, collaborator_id, contract_id, payslip_id):
+        return self._get(self._file_name(collaborator_id, contract_id, payslip_id, KIND_SINGLE_PAGE)) is not None
+
+    def put(self, collaborator_id, contract_id, payslip_id, pdf=None, page=None, single_page=False):
+        if pdf:
+            self._put(self._file_name(collaborator_id, contract_id, payslip_id, KIND_PDF), pdf)
+        if page:
+            self._put(self._file_name(collaborator_id, contract_id, payslip_id, KIND_PAGE), page)
+        if single_page:
+            self._put(self._file_name(collaborator_id, contract_id, payslip_id, KIND_SINGLE_PAGE), b"")
+
+def cache_from_env():
+    """Crée le cache à partir de PAYSLIP_CACHE_DIR, PAYSLIP_CACHE_MAX_BYTES et
+    PAYSLIP_CACHE_KEY ; renvoie None si aucun dossier n'est configuré."""
+    directory = os.environ.get("PAYSLIP_CACHE_DIR")
+    if not directory:
+        return None
+    max_bytes = int(os.environ.get("PAYSLIP_CACHE_MAX_BYTES") or DEFAULT_CACHE_MAX_BYTES)
+    return PayslipCache(directory, max_bytes, os.environ.get("PAYSLIP_CACHE_KEY"))
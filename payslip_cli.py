@@ -0,0 +1,264 @@
+"""Récupération des bulletins en ligne de commande, sans Streamlit.
+
+Utilise le même pipeline que l'application (payslip_pipeline) ; la clé API
+est lue dans la variable d'environnement PAYFIT_API_KEY.
+
+Usage :
+    PAYFIT_API_KEY=... python payslip_cli.py monthly [--year 2025 --month 03] -o bulletins.zip
+    PAYFIT_API_KEY=... python payslip_cli.py yearly --year 2024 -o bulletins_2024/
+    PAYFIT_API_KEY=... python payslip_cli.py range --from 2022-01 --to 2024-12 -o bulletins.zip
+
+Sans --year/--month, la récupération mensuelle porte sur le mois précédent
+(cron du début de mois). Avec --incremental, seuls les bulletins absents du
+manifeste (--manifest ou SYNC_MANIFEST_PATH) ou réémis depuis le dernier
+export sont téléchargés ; --append les ajoute alors au ZIP existant. La sortie est un ZIP si son nom finit par .zip,
+un dossier sinon (--format pour forcer). --metrics écrit les mesures par
+étape, au format texte de Prometheus si le nom finit par .prom, en JSON sinon. Les variables d'environnement de
+l'application (PAYSLIP_CACHE_DIR, ZIP_COMPRESSION, PDF_EXTRACTION_WORKERS...)
+s'appliquent aussi ici.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import date
+
+from job_engine import JobEngine, JOB_DONE, JOB_CANCELLED
+from payfit_api import IntrospectionCache, RosterCache, PayslipIndex, DEFAULT_MAX_WORKERS
+from payslip_archive import create_archive_pool, COMPRESSION_MODES
+from payslip_cache import cache_from_env
+from payslip_pipeline import PipelineContext, record_exported, run_monthly, run_range, run_yearly
+from secret_handle import SecretHandle
+from sync_manifest import SyncManifest, manifest_from_env
+import payslip_pdf
+
+API_KEY_ENV = "PAYFIT_API_KEY"
+
+# Codes de sortie
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_CANCELLED = 130
+
+# Intervalle d'affichage de l'avancement, en secondes
+PROGRESS_INTERVAL = 2.0
+
+def previous_month(today=None):
+    today = today or date.today()
+    if today.month == 1:
+        return today.year - 1, 12
+    return today.year, today.month - 1
+
+def parse_period(value):
+    """Période AAAA-MM de la ligne de commande, renvoyée en (année, mois)"""
+    try:
+        year, month = (int(part) for part in value.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"période invalide : {value} (format attendu AAAA-MM)")
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f"mois invalide : {value}")
+    return year, month
+
+def create_context(manifest_path=None):
+    workers = os.environ.get("PDF_EXTRACTION_WORKERS")
+    extraction_pool = None if workers == "0" else payslip_pdf.create_extraction_pool(int(workers) if workers else None)
+    workers = os.environ.get("ARCHIVE_WORKERS")
+    archive_pool = None if workers == "0" else create_archive_pool(int(workers) if workers else None)
+    manifest = SyncManifest(manifest_path) if manifest_path else manifest_from_env()
+    return PipelineContext(
+        RosterCache(), PayslipIndex(), cache_from_env(), extraction_pool, archive_pool, IntrospectionCache(), manifest
+    )
+
+def wait_for(job, verbose=False):
+    """Affiche l'avancement sur stderr jusqu'à la fin de la tâche ; Ctrl+C l'annule"""
+    last_status = None
+    while not job.finished:
+        try:
+            time.sleep(PROGRESS_INTERVAL)
+        except KeyboardInterrupt:
+            print("Annulation...", file=sys.stderr)
+            job.cancel()
+            continue
+        if job.status and job.status != last_status:
+            last_status = job.status
+            print(f"[{job.progress:3d} %] {job.status[1]}", file=sys.stderr)
+    for level, message in job.messages:
+        print(f"{level}: {message}", file=sys.stderr)
+    if verbose:
+        print(job.log.text(), file=sys.stderr)
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def merge_into_zip(path, source):
+    """Ajoute au ZIP path les fichiers du ZIP source (objet fichier) ; ceux de même nom sont remplacés"""
+    temp_path = f"{path}.tmp"
+    try:
+        with zipfile.ZipFile(source) as new, zipfile.ZipFile(path) as old, zipfile.ZipFile(temp_path, 'w') as merged:
+            new_names = set(new.namelist())
+            for info in old.infolist():
+                if info.filename not in new_names:
+                    merged.writestr(info, old.read(info))
+            for info in new.infolist():
+                merged.writestr(info, new.read(info))
+        os.replace(temp_path, path)
+    except BaseException:
+        # Le ZIP existant reste intact ; la fusion inachevée est supprimée
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_zip(output, content=None, archive=None, append=False):
+    """Écrit le ZIP (contenu en mémoire ou archive sur disque) ; avec append, le fusionne dans output s'il existe"""
+    if append and os.path.exists(output):
+        with tempfile.TemporaryFile() as source:
+            if archive is not None:
+                archive.copy_to(source)
+            else:
+                source.write(content)
+            source.seek(0)
+            merge_into_zip(output, source)
+        return
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'wb') as f:
+        if archive is not None:
+            archive.copy_to(f)
+        else:
+            f.write(content)
+
+def write_metrics(path, metrics, **labels):
+    if path.lower().endswith(".prom"):
+        text = metrics.to_prometheus(**labels)
+    else:
+        text = metrics.to_json(**labels)
+    write_file(path, text.encode())
+
+def write_monthly(result, output, output_format, append=False):
+    if output_format == "zip":
+        if result["zip_content"]:
+            write_zip(output, result["zip_content"], append=append)
+        return len(result["payslip_data"])
+    for data in result["payslip_data"].values():
+        write_file(os.path.join(output, data["file_name"]), data["content"])
+    return len(result["payslip_data"])
+
+def write_yearly(result, output, output_format, append=False):
+    archive = result["archive"]
+    try:
+        if output_format == "zip":
+            if archive is not None:
+                if archive.entry_count:
+                    write_zip(output, archive=archive, append=append)
+            elif result["zip_content"]:
+                write_zip(output, result["zip_content"], append=append)
+        elif archive is not None:
+            archive.extract_all(output)
+        else:
+            for months_data in result["collaborator_payslips"].values():
+                for payslip_data in months_data.values():
+                    write_file(os.path.join(output, *payslip_data["zip_path"].split("/")), payslip_data["content"])
+    finally:
+        if archive is not None:
+            archive.close()
+    return result["yearly_stats"]["total_payslips_found"]
+
+def parse_args(argv=None):
+    default_year, default_month = previous_month()
+    parser = argparse.ArgumentParser(description="Récupère la 2ème page des bulletins de paie Payfit")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    monthly = subparsers.add_parser("monthly", help="bulletins d'un mois")
+    monthly.add_argument("--year", type=int, default=default_year)
+    monthly.add_argument("--month", type=int, choices=range(1, 13), default=default_month, metavar="1-12")
+
+    yearly = subparsers.add_parser("yearly", help="tous les bulletins d'une année")
+    yearly.add_argument("--year", type=int, default=default_year)
+
+    period_range = subparsers.add_parser("range", help="bulletins d'une période, rangés par année")
+    period_range.add_argument("--from", dest="start", type=parse_period, required=True, metavar="AAAA-MM")
+    period_range.add_argument("--to", dest="end", type=parse_period, required=True, metavar="AAAA-MM")
+
+    for subparser in (yearly, period_range):
+        subparser.add_argument("--streaming", action="store_true",
+                               help="écrire le ZIP au fil de l'eau sur disque (mémoire limitée)")
+        subparser.add_argument("--compression", choices=COMPRESSION_MODES,
+                               help="compression du ZIP (ZIP_COMPRESSION par défaut)")
+
+    for subparser in (monthly, yearly, period_range):
+        subparser.add_argument("-o", "--output", required=True, help="fichier .zip ou dossier de sortie")
+        subparser.add_argument("--format", choices=("zip", "dir"), help="forcer le type de sortie")
+        subparser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
+                               help="requêtes simultanées vers l'API")
+        subparser.add_argument("--incremental", action="store_true",
+                               help="ne récupérer que les bulletins pas encore exportés, ou réémis")
+        subparser.add_argument("--append", action="store_true",
+                               help="ajouter les bulletins au ZIP de sortie s'il existe déjà, au lieu de le remplacer")
+        subparser.add_argument("--manifest", help="manifeste des exports (SYNC_MANIFEST_PATH par défaut)")
+        subparser.add_argument("--metrics", help="fichier où écrire les mesures par étape (.prom ou .json)")
+        subparser.add_argument("-v", "--verbose", action="store_true", help="afficher le journal complet")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    api_key = os.environ.get(API_KEY_ENV)
+    if not api_key:
+        print(f"La variable d'environnement {API_KEY_ENV} n'est pas définie.", file=sys.stderr)
+        return EXIT_USAGE
+    output_format = args.format or ("zip" if args.output.lower().endswith(".zip") else "dir")
+    # Effacée par le pipeline à la fin de la récupération
+    api_key = SecretHandle(api_key)
+
+    context = create_context(args.manifest)
+    engine = JobEngine(max_workers=1)
+    if args.mode == "monthly":
+        job = engine.submit("monthly", run_monthly, api_key, context, str(args.year), str(args.month).zfill(2),
+                            args.max_workers, incremental=args.incremental)
+    elif args.mode == "yearly":
+        job = engine.submit("yearly", run_yearly, api_key, context, args.year, args.max_workers,
+                            streaming_zip=args.streaming, compression=args.compression,
+                            incremental=args.incremental)
+    else:
+        job = engine.submit("range", run_range, api_key, context, args.start, args.end, args.max_workers,
+                            streaming_zip=args.streaming, compression=args.compression,
+                            incremental=args.incremental)
+    del api_key
+
+    try:
+        wait_for(job, args.verbose)
+        if job.state == JOB_CANCELLED:
+            print("Traitement annulé.", file=sys.stderr)
+            return EXIT_CANCELLED
+        if job.state != JOB_DONE:
+            print(job.error, file=sys.stderr)
+            if job.traceback:
+                print(job.traceback, file=sys.stderr)
+            return EXIT_FAILED
+
+        try:
+            if args.metrics:
+                period = f"{args.year}-{args.month:02d}" if args.mode == "monthly" else job.result["period_slug"]
+                write_metrics(args.metrics, job.result["metrics"], mode=args.mode, period=period)
+            if args.mode == "monthly":
+                count = write_monthly(job.result, args.output, output_format, args.append)
+            else:
+                count = write_yearly(job.result, args.output, output_format, args.append)
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"Impossible d'écrire la sortie : {e}", file=sys.stderr)
+            return EXIT_FAILED
+        # Les bulletins ne sont marqués comme exportés qu'une fois la sortie écrite
+        record_exported(context.manifest, job.result)
+        print(f"{count} bulletin(s) écrit(s) dans {args.output}", file=sys.stderr)
+        return EXIT_OK
+    finally:
+        for pool in (context.extraction_pool, context.archive_pool):
+            if pool is not None:
+                pool.shutdown()
+        if context.manifest is not None:
+            context.manifest.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""Extraction de la 2ème page des bulletins, sans dépendance à Streamlit.
+
+Les fonctions de ce module renvoient avertissements et erreurs sous forme de
+données, pour pouvoir tourner dans un pool de processus hors du thread de
+l'interface.
+"""
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import PyPDF2  # Bibliothèque pour manipuler les PDF
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject, NumberObject
+
+# Nombre de PDF envoyés ensemble à un processus d'extraction
+DEFAULT_BATCH_SIZE = 16
+# Octets de PDF gardés au plus par l'étape d'extraction (lot en cours et lots envoyés au pool)
+DEFAULT_MAX_PENDING_BYTES = 32 * 1024 * 1024
+
+# Moteurs d'extraction : "lazy" ne lit que la page demandée, "full" passe par PdfReader/PdfWriter
+ENGINE_LAZY = "lazy"
+ENGINE_FULL = "full"
+DEFAULT_ENGINE = ENGINE_LAZY
+
+# Avertissement des bulletins sans 2ème page
+SINGLE_PAGE_WARNING = "Le fichier n'a qu'une seule page."
+
+# Attributs qu'une page peut hériter de ses nœuds /Pages parents
+INHERITABLE_PAGE_KEYS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+class LazyExtractionUnsupported(Exception):
+    """Structure de PDF que le moteur "lazy" ne sait pas traiter : on repasse par le moteur complet"""
+
+def _find_page(reader, index):
+    """Descend l'arbre des pages jusqu'à la page `index` en sautant les sous-arbres grâce à /Count.
+
+    Renvoie (page, référence indirecte de la page, attributs hérités).
+    """
+    node = reader.trailer["/Root"].get_object()["/Pages"].get_object()
+    inherited = {}
+    page_ref = None
+    while "/Kids" in node:
+        for key in INHERITABLE_PAGE_KEYS:
+            if key in node:
+                inherited[key] = node.raw_get(key)
+        for kid_ref in node["/Kids"]:
+            kid = kid_ref.get_object()
+            count = int(kid["/Count"]) if "/Kids" in kid else 1
+            if index < count:
+                node, page_ref = kid, kid_ref
+                break
+            index -= count
+        else:
+            raise LazyExtractionUnsupported("arbre des pages incohérent")
+    if not isinstance(page_ref, IndirectObject):
+        raise LazyExtractionUnsupported("page non référencée indirectement")
+    return node, page_ref, inherited
+
+def _collect_references(obj, references):
+    if isinstance(obj, IndirectObject):
+        references.append(obj)
+    elif isinstance(obj, DictionaryObject):
+        for value in obj.values():
+            _collect_references(value, references)
+    elif isinstance(obj, ArrayObject):
+        for value in obj:
+            _collect_references(value, references)
+
+def _extract_page_lazy(reader, index):
+    """Copie une seule page et les objets qu'elle référence, sans parcourir tout le document.
+
+    Les objets gardent leur numéro d'origine (les numéros non utilisés sont
+    marqués libres dans la table xref) : il n'y a ni clonage ni renumérotation,
+    et les renvois vers la page (annotations /P) restent valides. Les autres
+    pages éventuellement référencées (liens internes) sont remplacées par null.
+    """
+    page, page_ref, inherited = _find_page(reader, index)
+
+    # Deux numéros libres pour les nouveaux /Pages et /Catalog
+    highest_id = max([int(reader.trailer.get("/Size", 0))]
+                     + [idnum + 1 for xref in reader.xref.values() for idnum in xref]
+                     + [idnum + 1 for idnum in reader.xref_objStm])
+    pages_id, catalog_id = highest_id, highest_id + 1
+
+    new_page = DictionaryObject(page)
+    for key, value in inherited.items():
+        if key not in new_page:
+            new_page[NameObject(key)] = value
+    new_page[NameObject("/Parent")] = IndirectObject(pages_id, 0, None)
+    new_page.pop(NameObject("/StructParents"), None)
+
+    objects = {(page_ref.idnum, page_ref.generation): new_page}
+    to_visit = []
+    _collect_references(new_page, to_visit)
+    while to_visit:
+        ref = to_visit.pop()
+        key = (ref.idnum, ref.generation)
+        if key in objects or ref.idnum >= pages_id:
+            continue
+        obj = reader.get_object(ref)
+        if obj is None:
+            obj = NullObject()
+        elif isinstance(obj, DictionaryObject) and obj.get("/Type") in ("/Page", "/Pages"):
+            obj = NullObject()
+        objects[key] = obj
+        _collect_references(obj, to_visit)
+
+    objects[(pages_id, 0)] = DictionaryObject({
+        NameObject("/Type"): NameObject("/Pages"),
+        NameObject("/Count"): NumberObject(1),
+        NameObject("/Kids"): ArrayObject([IndirectObject(page_ref.idnum, page_ref.generation, None)])
+    })
+    objects[(catalog_id, 0)] = DictionaryObject({
+        NameObject("/Type"): NameObject("/Catalog"),
+        NameObject("/Pages"): IndirectObject(pages_id, 0, None)
+    })
+
+    output_pdf = io.BytesIO()
+    header = reader.pdf_header
+    output_pdf.write((header.encode() if isinstance(header, str) else header) + b"\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for idnum, generation in sorted(objects):
+        offsets[idnum] = (output_pdf.tell(), generation)
+        output_pdf.write(f"{idnum} {generation} obj\n".encode())
+        objects[(idnum, generation)].write_to_stream(output_pdf, None)
+        output_pdf.write(b"\nendobj\n")
+
+    xref_position = output_pdf.tell()
+    size = catalog_id + 1
+    output_pdf.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+    for idnum in range(1, size):
+        if idnum in offsets:
+            offset, generation = offsets[idnum]
+            output_pdf.write(f"{offset:010d} {generation:05d} n \n".encode())
+        else:
+            output_pdf.write(b"0000000000 65535 f \n")
+    output_pdf.write(
+        f"trailer\n<<\n/Size {size}\n/Root {catalog_id} 0 R\n>>\nstartxref\n{xref_position}\n%%EOF\n".encode()
+    )
+    return output_pdf.getvalue()
+
+def extract_second_page(pdf_content, engine=DEFAULT_ENGINE):
+    """Renvoie {"content": 2ème page ou None, "warning": message ou None, "error": message ou None}"""
+    if engine == ENGINE_LAZY:
+        try:
+            reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
+            if reader.is_encrypted:
+                raise LazyExtractionUnsupported("PDF chiffré")
+            page_count = int(reader.trailer["/Root"].get_object()["/Pages"].get_object()["/Count"])
+            if page_count < 2:
+                return {"content": None, "warning": SINGLE_PAGE_WARNING, "error": None}
+            return {"content": _extract_page_lazy(reader, 1), "warning": None, "error": None}
+        except Exception:
+            # Tout cas non prévu repasse par le moteur complet, qui produit le message d'erreur habituel
+            pass
+    return _extract_second_page_full(pdf_content)
+
+def _extract_second_page_full(pdf_content):
+    try:
+        input_pdf = io.BytesIO(pdf_content)
+        pdf_reader = PyPDF2.PdfReader(input_pdf)
+
+        if len(pdf_reader.pages) < 2:
+            return {"content": None, "warning": SINGLE_PAGE_WARNING, "error": None}
+
+        pdf_writer = PyPDF2.PdfWriter()
+        pdf_writer.add_page(pdf_reader.pages[1])
+
+        output_pdf = io.BytesIO()
+        pdf_writer.write(output_pdf)
+        output_pdf.seek(0)
+
+        return {"content": output_pdf.getvalue(), "warning": None, "error": None}
+    except Exception as e:
+        return {"content": None, "warning": None, "error": f"Erreur lors de l'extraction de la 2ème page: {str(e)}"}
+
+def is_single_page(result):
+    """Vrai si l'extraction a échoué parce que le bulletin n'a qu'une page : inutile de la retenter"""
+    return result["content"] is None and result["warning"] == SINGLE_PAGE_WARNING
+
+def timed_extraction(pdf_content):
+    """extract_second_page, avec en plus "seconds" : la durée de l'extraction"""
+    start = time.perf_counter()
+    result = extract_second_page(pdf_content)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def extract_second_pages(pdf_contents):
+    """Extrait la 2ème page d'un lot de PDF (exécuté dans un processus du pool)"""
+    return [timed_extraction(pdf_content) for pdf_content in pdf_contents]
+
+def create_extraction_pool(max_workers=None):
+    """Pool de processus pour l'extraction.
+
+    Les processus sont lancés en mode "spawn" : un fork du serveur Streamlit,
+    qui fait tourner de nombreux threads, pourrait hériter de verrous pris.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def extract_pages(downloads, executor=None, batch_size=DEFAULT_BATCH_SIZE, max_pending_batches=None,
+                  max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+    """Étape d'extraction branchée sur la sortie de download_payslip_pdfs.
+
+    `downloads` produit des (job, status_code, pdf_content) ; l'étape renvoie
+    des (job, status_code, pdf_content, result) où result est le dict de
+    timed_extraction, ou None si le téléchargement a échoué. Les PDF sont
+    envoyés au pool par lots de batch_size, avec au plus max_pending_batches
+    lots en cours. Les PDF rendus par le téléchargement ne comptent plus dans
+    son budget : l'étape garde elle-même au plus max_pending_bytes octets de
+    PDF (un lot est envoyé plus tôt s'il atteint la limite, et l'étape attend
+    qu'un lot se termine avant d'en accepter d'autres). Sans executor,
+    l'extraction se fait dans le thread appelant, un PDF à la fois.
+    """
+    if executor is None:
+        for job, status_code, pdf_content in downloads:
+            result = timed_extraction(pdf_content) if status_code == 200 else None
+            yield job, status_code, pdf_content, result
+        return
+
+    max_pending_batches = max_pending_batches or 2 * (os.cpu_count() or 1)
+    pending = {}  # {future: lot de (job, status_code, pdf_content)}
+    batch = []
+    held = {"bytes": 0}  # Octets de PDF du lot en cours et des lots envoyés
+
+    def submit(batch):
+        future = executor.submit(extract_second_pages, [pdf_content for _, _, pdf_content in batch])
+        pending[future] = batch
+
+    def completed(block):
+        if block:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        else:
+            done = [future for future in pending if future.done()]
+        for future in done:
+            batch = pending.pop(future)
+            held["bytes"] -= sum(len(pdf_content) for _, _, pdf_content in batch)
+            for (job, status_code, pdf_content), result in zip(batch, future.result()):
+                yield job, status_code, pdf_content, result
+
+    for job, status_code, pdf_content in downloads:
+        if status_code != 200:
+            yield job, status_code, pdf_content, None
+            continue
+        if held["bytes"] + len(pdf_content) > max_pending_bytes:
+            # Limite d'octets atteinte : le lot part tel quel et l'étape attend que des lots se terminent
+            if batch:
+                submit(batch)
+                batch = []
+            while pending and held["bytes"] + len(pdf_content) > max_pending_bytes:
+                yield from completed(block=True)
+        batch.append((job, status_code, pdf_content))
+        held["bytes"] += len(pdf_content)
+        if len(batch) >= batch_size:
+            submit(batch)
+            batch = []
+            while len(pending) >= max_pending_batches:
+                yield from completed(block=True)
+        # Les lots déjà terminés sont rendus sans attendre la fin des téléchargements
+        yield from completed(block=False)
+
+    if batch:
+        submit(batch)
+    while pending:
+        yield from completed(block=True)
@@ -0,0 +1,669 @@
+"""Récupération des bulletins mensuels et annuels, sans dépendance à Streamlit.
+
+Les fonctions run_monthly et run_yearly s'exécutent comme des tâches du
+moteur (job_engine) : elles reçoivent la tâche `task` pour y publier
+progression, étapes, avertissements et journal, et renvoient un dict de
+résultats que l'interface recopie ensuite dans la session. Une clé API
+passée en SecretHandle est effacée à la fin de la récupération. Chaque
+résultat contient aussi les mesures par étape de la récupération
+(run_metrics.RunMetrics, clé "metrics").
+"""
+import threading
+
+from job_engine import JobError
+from payfit_api import PayfitClient, download_payslip_pdfs, DEFAULT_MAX_WORKERS, DEFAULT_MAX_INFLIGHT_BYTES
+from payslip_archive import StreamingZipArchive, compression_policy_from_env, DEFAULT_SPOOL_MAX_SIZE
+import payslip_pdf
+from run_metrics import RunMetrics
+from run_profiler import ProfilerBusy, RunProfiler
+from secret_handle import wiped_after
+from sync_manifest import payslip_fingerprint
+
+# Mémoire occupée par les PDF entre leur réception et la fin de leur extraction,
+# partagée entre l'étape de téléchargement et celle d'extraction
+PDF_MEMORY_BUDGET = DEFAULT_MAX_INFLIGHT_BYTES
+
+class PipelineContext:
+    """Ressources partagées par les récupérations (caches, pools).
+
+    payslip_cache, extraction_pool et archive_pool peuvent valoir None :
+    l'étape correspondante se fait alors sans cache ou dans le thread de la
+    tâche. Sans introspect_cache, la clé est vérifiée à chaque récupération.
+    Sans manifest, les exports ne sont pas enregistrés et le mode
+    incrémental n'est pas disponible.
+    """
+
+    def __init__(self, roster_cache, payslip_index, payslip_cache=None, extraction_pool=None,
+                 archive_pool=None, introspect_cache=None, manifest=None):
+        self.roster_cache = roster_cache
+        self.payslip_index = payslip_index
+        self.payslip_cache = payslip_cache
+        self.extraction_pool = extraction_pool
+        self.archive_pool = archive_pool
+        self.introspect_cache = introspect_cache
+        self.manifest = manifest
+
+    def introspect(self, client):
+        if self.introspect_cache is None:
+            return client.introspect()
+        return self.introspect_cache.introspect(client)
+
+def report_extraction(task, result):
+    """Publie l'avertissement ou l'erreur d'une extraction et renvoie la page extraite"""
+    if result["warning"]:
+        task.add_message("warning", result["warning"])
+    if result["error"]:
+        task.add_message("error", result["error"])
+    return result["content"]
+
+def route_cached_pages(task, cache, payslip_jobs, store_page, skip_page, metrics):
+    """Passe à store_page(job, page) les bulletins dont la 2ème page est en cache et renvoie les autres, à télécharger.
+
+    Les bulletins connus pour n'avoir qu'une page, ou dont le PDF en cache
+    vient d'être extrait sans succès, sont passés à skip_page(job) : les
+    télécharger à nouveau ne donnerait rien de plus.
+    """
+    for job in payslip_jobs:
+        ids = (job["collaborator_id"], job["contract_id"], job["payslip_id"])
+        page = pdf = None
+        single_page = False
+        if cache:
+            with metrics.timer("cache"):
+                page = cache.get_page(*ids)
+                single_page = page is None and cache.is_single_page(*ids)
+                pdf = cache.get_pdf(*ids) if page is None and not single_page else None
+            if pdf:
+                # PDF brut en cache mais page pas encore extraite
+                extraction = payslip_pdf.timed_extraction(pdf)
+                observe_extraction(metrics, pdf, extraction)
+                page = report_extraction(task, extraction)
+                cache.put(*ids, page=page, single_page=payslip_pdf.is_single_page(extraction))
+            elif single_page:
+                task.add_message("warning", payslip_pdf.SINGLE_PAGE_WARNING)
+            metrics.add_bytes("cache", len(page or pdf or b""))
+        if page:
+            store_page(job, page)
+        elif single_page or pdf:
+            skip_page(job)
+        else:
+            yield job
+
+def close_stages(*stages):
+    """Ferme les étapes déjà lancées (générateurs, None sinon), de la dernière à la première,
+    pendant que le client est encore ouvert"""
+    for stage in stages:
+        if stage is not None:
+            stage.close()
+
+def observe_extraction(metrics, pdf_content, extraction):
+    metrics.observe("extraction", extraction["seconds"], len(pdf_content), error=bool(extraction["error"]))
+
+def check_incremental(context, incremental):
+    if incremental and context.manifest is None:
+        raise JobError("❌ Mode incrémental indisponible : aucun manifeste configuré (SYNC_MANIFEST_PATH).")
+
+def exported_fingerprints(context, company_id, incremental):
+    """{payslip_id: empreinte} des bulletins déjà exportés en mode incrémental, {} sinon"""
+    return context.manifest.exported_fingerprints(company_id) if incremental else {}
+
+def record_exported(manifest, result):
+    """Enregistre dans le manifeste les bulletins d'un résultat (clé "exported_jobs").
+
+    À appeler par l'appelant une fois l'export enregistré (fichier écrit,
+    réception confirmée) : un export perdu ne doit pas être marqué comme fait.
+    """
+    if manifest is not None and result["exported_jobs"]:
+        manifest.record(result["company_id"], result["exported_jobs"])
+
+def get_company_and_collaborators(client, context, refresh_roster=False):
+    """Fonction commune pour récupérer les infos de l'entreprise et les collaborateurs"""
+    try:
+        # Vérification de la clé API
+        data = context.introspect(client)
+        if not data.get("active"):
+            raise JobError("❌ Clé API invalide ou expirée.")
+
+        company_id = data["company_id"]
+
+        # Infos de l'entreprise
+        company_info = client.get_company(company_id)
+
+        # Récupération des collaborateurs (liste en cache si encore valide)
+        all_collabs, _ = context.roster_cache.get_collaborators(client, company_id, force_refresh=refresh_roster)
+
+        return company_id, company_info, all_collabs
+
+    except JobError:
+        raise
+    except Exception as e:
+        raise JobError(f"Erreur lors de la récupération des données: {str(e)}")
+
+def yearly_zip_path(collaborator_name, file_name, year=None):
+    """Chemin d'un bulletin dans le ZIP annuel : Collaborateur/fichier.pdf, ou Année/Collaborateur/fichier.pdf"""
+    safe_name = collaborator_name.replace(' ', '_').replace('/', '_')
+    if year is not None:
+        return f"{year}/{safe_name}/{file_name}"
+    return f"{safe_name}/{file_name}"
+
+def period_label(start_period, end_period):
+    """Libellé d'une période : 2024 pour une année complète, 01/2022 - 12/2024 sinon"""
+    (start_year, start_month), (end_year, end_month) = start_period, end_period
+    if start_year == end_year and (start_month, end_month) == (1, 12):
+        return str(start_year)
+    return f"{start_month:02d}/{start_year} - {end_month:02d}/{end_year}"
+
+def period_slug(start_period, end_period):
+    """Version de period_label utilisable dans un nom de fichier : 2024 ou 2022-01_2024-12"""
+    (start_year, start_month), (end_year, end_month) = start_period, end_period
+    if start_year == end_year and (start_month, end_month) == (1, 12):
+        return str(start_year)
+    return f"{start_year}-{start_month:02d}_{end_year}-{end_month:02d}"
+
+def run_profiled(task, run, api_key, *args, **kwargs):
+    """Exécute run (run_monthly ou run_range) sous cProfile et tracemalloc.
+
+    Le profil (run_profiler.RunProfile, étiqueté par mode, période et
+    nombre de collaborateurs) est ajouté au résultat sous la clé "profile".
+    """
+    profiler = RunProfiler()
+    try:
+        with wiped_after(api_key), profiler:
+            result = run(task, api_key, *args, **kwargs)
+    except ProfilerBusy:
+        raise JobError("❌ Un profilage est déjà en cours sur le serveur ; réessayez quand il sera terminé.")
+    if "yearly_stats" in result:
+        tags = {"mode": "yearly", "period": result["period_slug"],
+                "collaborators": result["yearly_stats"]["total_collaborators"]}
+    else:
+        tags = {"mode": "monthly", "period": f"{result['target_year']}-{result['target_month']}",
+                "collaborators": len(result["collabs"])}
+    result["profile"] = profiler.result(**tags)
+    return result
+
+def client_pool_size(max_workers):
+    """Connexions nécessaires : listes de bulletins et téléchargements tournent en même temps,
+    chacun avec max_workers threads"""
+    return 2 * max_workers
+
+def run_yearly(task, api_key, context, target_year, max_workers=DEFAULT_MAX_WORKERS, refresh_roster=False,
+               streaming_zip=False, compression=None, incremental=False):
+    """Récupère tous les bulletins de l'année (voir run_range)"""
+    return run_range(task, api_key, context, (int(target_year), 1), (int(target_year), 12), max_workers,
+                     refresh_roster, streaming_zip, compression, incremental)
+
+def run_range(task, api_key, context, start_period, end_period, max_workers=DEFAULT_MAX_WORKERS,
+              refresh_roster=False, streaming_zip=False, compression=None, incremental=False):
+    """Récupère tous les bulletins entre deux périodes (année, mois) incluses.
+
+    La liste de chaque collaborateur n'est lue qu'une fois, quel que soit le
+    nombre d'années couvertes. Sur plusieurs années, le ZIP est rangé par
+    année puis par collaborateur. En mode incrémental, les bulletins déjà
+    exportés (voir sync_manifest) et pas réémis depuis sont ignorés.
+
+    Renvoie company_id, company_info, collaborator_payslips ({nom: {"AAAA-MM": bulletin}}),
+    yearly_stats, period_label, period_slug, puis zip_content ou archive
+    (mode archive sur disque), zip_stats, policy, metrics et exported_jobs
+    (à passer à record_exported une fois l'export enregistré).
+    """
+    start_period, end_period = tuple(map(int, start_period)), tuple(map(int, end_period))
+    label = period_label(start_period, end_period)
+    by_year = start_period[0] != end_period[0]  # Un dossier par année dans le ZIP
+    metrics = RunMetrics()
+    with wiped_after(api_key), PayfitClient(api_key, pool_size=client_pool_size(max_workers), metrics=metrics) as client:
+        if start_period > end_period:
+            raise JobError("❌ La période de début doit précéder la période de fin.")
+        check_incremental(context, incremental)
+        # Récupération des données communes
+        company_id, company_info, collabs = get_company_and_collaborators(client, context, refresh_roster)
+
+        task.set_status("success", f"✅ Clé valide. Entreprise : {company_info['name']}")
+        task.set_progress(10)
+
+        # Structure pour organiser les bulletins par collaborateur
+        collaborator_payslips = {}  # {collaborator_name: {"AAAA-MM": pdf_content}}
+        yearly_stats = {
+            'total_collaborators': len(collabs),
+            'collaborators_with_payslips': 0,
+            'total_payslips_found': 0,
+            'already_exported': 0,
+            'months_processed': set()
+        }
+
+        task.log.append(f"Début du traitement des bulletins ({label})...")
+        task.log.append()
+
+        total_collabs = len(collabs)
+        payslip_jobs = []
+        progress = {"collaborators": 0, "done": 0, "cached": 0}
+
+        def update_progress():
+            task.set_progress(10 + 40 * progress["collaborators"] / max(total_collabs, 1)
+                              + 40 * progress["done"] / max(len(payslip_jobs), 1))
+
+        # Les étapes s'enchaînent sans attendre la fin de la précédente : listes → cache →
+        # téléchargement → extraction → archive. Chaque page est écrite dans le ZIP dès
+        # qu'elle est prête ; en mode archive sur disque, elle est ensuite libérée.
+        policy = compression_policy_from_env(compression)
+        archive = StreamingZipArchive(
+            policy, spool_max_size=DEFAULT_SPOOL_MAX_SIZE if streaming_zip else 0, executor=context.archive_pool
+        )
+        extracted_pages = {}  # {index du job: contenu de la 2ème page}, hors mode archive sur disque
+        written_jobs = set()  # Index des jobs déjà écrits dans l'archive
+        # Les pages en cache sont écrites depuis le thread qui lit les listes, les autres depuis la tâche
+        store_lock = threading.Lock()
+
+        def store_page(job, content):
+            with store_lock:
+                with metrics.timer("archive", len(content)):
+                    archive.add(job["zip_path"], content)
+                written_jobs.add(job["index"])
+                if not streaming_zip:
+                    extracted_pages[job["index"]] = content
+                progress["done"] += 1
+                update_progress()
+
+        # Levé par l'étape de téléchargement quand la récupération s'arrête
+        listing_stopped = threading.Event()
+
+        def store_cached_page(job, content):
+            store_page(job, content)
+            progress["cached"] += 1
+
+        def skip_cached_page(job):
+            task.log.append(f"    ⚠️ {job['full_name']} - {job['period']} - impossible d'extraire la 2ème page")
+            with store_lock:
+                progress["done"] += 1
+                update_progress()
+
+        def list_payslip_jobs():
+            """1. Listes de bulletins : index en mémoire, complété en parallèle pour les collaborateurs manquants"""
+            payslip_index = context.payslip_index
+            known = exported_fingerprints(context, company_id, incremental)
+            payslip_listings = payslip_index.load(client, company_id, collabs, max_workers, force_refresh=refresh_roster)
+            for i, (collab, payslips) in enumerate(zip(collabs, payslip_listings)):
+                task.raise_if_cancelled()
+                if listing_stopped.is_set():
+                    return
+                progress["collaborators"] = i + 1
+                update_progress()
+
+                collaborator_id = collab["id"]
+                full_name = f"{collab.get('firstName', '')} {collab.get('lastName', '')}".strip()
+
+                task.set_status("info", f"Traitement de {full_name}... ({i+1}/{total_collabs})")
+                task.log.append(f"📝 Traitement de {full_name}...")
+
+                if not payslips:
+                    task.log.append("  ❌ Aucun bulletin disponible")
+                    continue
+
+                # Bulletins de la période, lus dans l'index
+                period_payslips = payslip_index.for_range(company_id, collaborator_id, start_period, end_period)
+
+                if not period_payslips:
+                    task.log.append(f"  ❌ Aucun bulletin pour {label}")
+                    continue
+
+                # Mode incrémental : les bulletins déjà exportés, et pas réémis depuis, sont ignorés
+                fingerprints = [payslip_fingerprint(payslip) for payslip in period_payslips]
+                new_payslips = [
+                    (payslip, fingerprint) for payslip, fingerprint in zip(period_payslips, fingerprints)
+                    if known.get(str(payslip["payslipId"])) != fingerprint
+                ]
+                if len(new_payslips) < len(period_payslips):
+                    yearly_stats['already_exported'] += len(period_payslips) - len(new_payslips)
+                    task.log.append(f"  ♻️ {len(period_payslips) - len(new_payslips)} bulletin(s) déjà exporté(s)")
+                if not new_payslips:
+                    continue
+                period_payslips = [payslip for payslip, _ in new_payslips]
+
+                # Initialiser le dictionnaire pour ce collaborateur
+                collaborator_payslips[full_name] = {}
+
+                task.log.append(f"  ✅ {len(period_payslips)} bulletin(s) trouvé(s) pour {label}")
+                task.log.append()
+
+                for payslip, fingerprint in new_payslips:
+                    year = int(payslip["year"])
+                    month = str(payslip["month"]).zfill(2)  # Conversion en string avec format 2 chiffres
+                    period = f"{year}-{month}"
+                    yearly_stats['months_processed'].add(period)
+                    file_name = f"{full_name.replace(' ', '_')}_{year}_{month}.pdf"
+                    job = {
+                        "index": len(payslip_jobs),
+                        "full_name": full_name,
+                        "year": year,
+                        "month": int(month),
+                        "period": period,
+                        "fingerprint": fingerprint,
+                        "file_name": file_name,
+                        "zip_path": yearly_zip_path(full_name, file_name, year if by_year else None),
+                        "collaborator_id": collaborator_id,
+                        "contract_id": payslip["contractId"],
+                        "payslip_id": payslip["payslipId"]
+                    }
+                    payslip_jobs.append(job)
+                    yield job
+            task.set_status("info", f"📥 Téléchargement de {len(payslip_jobs)} bulletin(s)...")
+
+        pdf_downloads = extractions = None
+        try:
+            # 2. Bulletins déjà en cache, puis téléchargement des autres en parallèle ; les listes
+            # sont lues dans un thread à part pendant que les premiers PDF arrivent
+            cache = context.payslip_cache
+            download_jobs = route_cached_pages(
+                task, cache, list_payslip_jobs(), store_cached_page, skip_cached_page, metrics
+            )
+            pdf_downloads = download_payslip_pdfs(
+                client, company_id, download_jobs, max_workers, PDF_MEMORY_BUDGET // 2, stop=listing_stopped
+            )
+            # 3. La 2ème page est extraite par lots dans un pool de processus
+            extractions = payslip_pdf.extract_pages(pdf_downloads, context.extraction_pool,
+                                                    max_pending_bytes=PDF_MEMORY_BUDGET // 2)
+            for job, status_code, pdf_content, extraction in extractions:
+                task.raise_if_cancelled()
+                full_name, period = job["full_name"], job["period"]
+
+                if status_code == 200:
+                    observe_extraction(metrics, pdf_content, extraction)
+                    extracted_content = report_extraction(task, extraction)
+                    if cache:
+                        cache.put(job["collaborator_id"], job["contract_id"], job["payslip_id"],
+                                  pdf=pdf_content, page=extracted_content,
+                                  single_page=payslip_pdf.is_single_page(extraction))
+                    if extracted_content:
+                        # 4. Écriture dans l'archive
+                        store_page(job, extracted_content)
+                        task.log.append(f"    ✅ {full_name} - {period} - bulletin récupéré")
+                        continue
+                    task.log.append(f"    ⚠️ {full_name} - {period} - impossible d'extraire la 2ème page")
+                else:
+                    task.log.append(f"    ❌ {full_name} - {period} - erreur téléchargement (code {status_code})")
+                with store_lock:
+                    progress["done"] += 1
+                    update_progress()
+            if progress["cached"]:
+                task.log.append(f"♻️ {progress['cached']} bulletin(s) repris du cache")
+            with metrics.timer("archive"):
+                archive.finish()
+        except BaseException:
+            close_stages(extractions, pdf_downloads)
+            archive.close()
+            raise
+
+        # Les bulletins sont rangés dans l'ordre des listes, quel que soit l'ordre d'arrivée
+        collaborators_with_payslips = set()
+        for job in payslip_jobs:
+            if job["index"] not in written_jobs:
+                continue
+            payslip_data = {'file_name': job["file_name"], 'zip_path': job["zip_path"]}
+            if not streaming_zip:
+                # En mode archive sur disque, le contenu est dans l'archive : seules les métadonnées sont gardées
+                payslip_data['content'] = extracted_pages.pop(job["index"])
+            collaborator_payslips[job["full_name"]][job["period"]] = payslip_data
+            collaborators_with_payslips.add(job["collaborator_id"])
+            yearly_stats['total_payslips_found'] += 1
+        yearly_stats['collaborators_with_payslips'] = len(collaborators_with_payslips)
+        if incremental:
+            task.add_message("info", f"♻️ Mode incrémental : {yearly_stats['already_exported']} bulletin(s) "
+                                     f"déjà exporté(s) ignoré(s), {yearly_stats['total_payslips_found']} nouveau(x)")
+
+        # ZIP global : archive sur disque, ou contenu en mémoire
+        result = {
+            "company_id": company_id,
+            "company_info": company_info,
+            "collaborator_payslips": collaborator_payslips,
+            "yearly_stats": yearly_stats,
+            "target_year": start_period[0],
+            "start_period": start_period,
+            "end_period": end_period,
+            "period_label": label,
+            "period_slug": period_slug(start_period, end_period),
+            "policy": policy,
+            "archive": None,
+            "zip_content": None,
+            "zip_stats": archive.stats,
+            "metrics": metrics,
+            "exported_jobs": [job for job in payslip_jobs if job["index"] in written_jobs],
+        }
+        if streaming_zip:
+            result["archive"] = archive
+        else:
+            if collaborator_payslips:
+                result["zip_content"] = archive.read()
+            archive.close()
+        metrics.finish()
+
+        task.set_progress(100)
+        task.set_status("success", "✅ Traitement terminé!")
+        return result
+
+def run_monthly(task, api_key, context, target_year, target_month, max_workers=DEFAULT_MAX_WORKERS,
+                refresh_roster=False, incremental=False):
+    """Récupère la 2ème page des bulletins d'un mois.
+
+    Renvoie company_id, company_info, collabs, collabs_with_payslip,
+    collabs_without_payslip, payslip_data ({nom: bulletin}), already_exported
+    (mode incrémental), zip_content, zip_stats, policy, metrics et exported_jobs
+    (à passer à record_exported une fois l'export enregistré).
+    """
+    metrics = RunMetrics()
+    with wiped_after(api_key), PayfitClient(api_key, pool_size=client_pool_size(max_workers), metrics=metrics) as client:
+        check_incremental(context, incremental)
+        # 1. Vérification de la clé API
+        task.set_status("info", "🔎 Vérification de la clé API...")
+
+        data = context.introspect(client)
+        if not data.get("active"):
+            raise JobError("❌ Clé API invalide ou expirée.")
+
+        company_id = data["company_id"]
+        task.set_status("success", f"✅ Clé valide. Entreprise ID : {company_id}")
+        task.set_progress(10)
+
+        # 2. Infos détaillées de l'entreprise
+        company_info = client.get_company(company_id)
+        task.set_progress(20)
+
+        # 3. Récupération des collaborateurs (liste en cache si encore valide)
+        task.set_status("info", "📥 Récupération des collaborateurs...")
+
+        def show_roster_page(page_count, collabs_count):
+            task.set_status("info", f"📥 Récupération des collaborateurs... Page {page_count} ({collabs_count} collaborateurs jusqu'à présent)")
+
+        collabs, error_status = context.roster_cache.get_collaborators(
+            client, company_id, force_refresh=refresh_roster, on_page=show_roster_page
+        )
+        if error_status is not None:
+            task.add_message("error", f"❌ Erreur lors de la récupération des collaborateurs: {error_status}")
+
+        task.set_status("success", f"✅ {len(collabs)} collaborateurs récupérés.")
+        task.set_progress(30)
+
+        # 4. Filtrage + extraction
+        task.set_status("info", "🔍 Recherche des bulletins de paie...")
+
+        collabs_with_payslip = []
+        collabs_without_payslip = []
+        payslip_data = {}
+        payslip_jobs = []
+
+        total_collabs = len(collabs)
+        progress = {"collaborators": 0, "done": 0, "cached": 0, "already_exported": 0}
+
+        def update_progress():
+            task.set_progress(30 + 30 * progress["collaborators"] / max(total_collabs, 1)
+                              + 30 * progress["done"] / max(len(payslip_jobs), 1))
+
+        # Listes → cache → téléchargement → extraction → archive, sans attendre la fin de
+        # l'étape précédente : le ZIP est construit pendant les téléchargements
+        archive = StreamingZipArchive(compression_policy_from_env(), spool_max_size=0, executor=context.archive_pool)
+        extracted_pages = {}  # {index du job: contenu de la 2ème page}
+        # Les pages en cache sont écrites depuis le thread qui lit les listes, les autres depuis la tâche
+        store_lock = threading.Lock()
+
+        def store_page(job, content):
+            with store_lock:
+                with metrics.timer("archive", len(content)):
+                    archive.add(job["file_name"], content)
+                extracted_pages[job["index"]] = content
+                progress["done"] += 1
+                update_progress()
+
+        # Levé par l'étape de téléchargement quand la récupération s'arrête
+        listing_stopped = threading.Event()
+
+        def store_cached_page(job, content):
+            store_page(job, content)
+            progress["cached"] += 1
+
+        def skip_cached_page(job):
+            task.log.append(f"{job['full_name']} → ⚠️ Impossible d'extraire la 2ème page")
+            with store_lock:
+                progress["done"] += 1
+                update_progress()
+
+        def list_payslip_jobs():
+            """Listes de bulletins : index en mémoire, complété en parallèle pour les collaborateurs manquants"""
+            payslip_index = context.payslip_index
+            known = exported_fingerprints(context, company_id, incremental)
+            payslip_listings = payslip_index.load(client, company_id, collabs, max_workers, force_refresh=refresh_roster)
+            for i, (collab, payslips) in enumerate(zip(collabs, payslip_listings)):
+                task.raise_if_cancelled()
+                if listing_stopped.is_set():
+                    return
+                progress["collaborators"] = i + 1
+                update_progress()
+
+                collaborator_id = collab["id"]
+                full_name = f"{collab.get('firstName', '')} {collab.get('lastName', '')}".strip()
+
+                task.log.append(f"Traitement de {full_name}...")
+
+                if not payslips:
+                    collabs_without_payslip.append({
+                        "name": full_name,
+                        "id": collaborator_id,
+                        "reason": "Aucun bulletin disponible"
+                    })
+                    task.log.append("  → Aucun bulletin disponible")
+                    continue
+
+                target_payslip = next(iter(payslip_index.find(company_id, collaborator_id, target_year, target_month)), None)
+
+                if target_payslip:
+                    collabs_with_payslip.append({
+                        "name": full_name,
+                        "id": collaborator_id,
+                        "payslip_info": target_payslip
+                    })
+                    task.log.append(f"  → ✅ Bulletin trouvé pour {target_month}/{target_year}")
+
+                    # Mode incrémental : bulletin déjà exporté et pas réémis depuis
+                    fingerprint = payslip_fingerprint(target_payslip)
+                    if known.get(str(target_payslip["payslipId"])) == fingerprint:
+                        progress["already_exported"] += 1
+                        task.log.append("  → ♻️ Déjà exporté")
+                        continue
+
+                    file_safe_name = f"{collab.get('firstName', 'collaborateur')}_{collab.get('lastName', '')}".replace(" ", "_")
+                    job = {
+                        "index": len(payslip_jobs),
+                        "full_name": full_name,
+                        "file_name": f"{file_safe_name}_{target_year}_{target_month}.pdf",
+                        "year": int(target_year),
+                        "month": int(target_month),
+                        "fingerprint": fingerprint,
+                        "collaborator_id": collaborator_id,
+                        "contract_id": target_payslip["contractId"],
+                        "payslip_id": target_payslip["payslipId"]
+                    }
+                    payslip_jobs.append(job)
+                    yield job
+                else:
+                    collabs_without_payslip.append({
+                        "name": full_name,
+                        "id": collaborator_id,
+                        "reason": f"Pas de bulletin pour {target_month}/{target_year}",
+                        "available_periods": [f"{p['month']}/{p['year']}" for p in payslips]
+                    })
+                    task.log.append(f"  → Pas de bulletin pour {target_month}/{target_year}")
+            task.set_status("info", f"📥 Téléchargement de {len(payslip_jobs)} bulletin(s)...")
+
+        pdf_downloads = extractions = None
+        try:
+            # 5. Bulletins déjà en cache, puis téléchargement des autres en parallèle
+            cache = context.payslip_cache
+            download_jobs = route_cached_pages(
+                task, cache, list_payslip_jobs(), store_cached_page, skip_cached_page, metrics
+            )
+            pdf_downloads = download_payslip_pdfs(
+                client, company_id, download_jobs, max_workers, PDF_MEMORY_BUDGET // 2, stop=listing_stopped
+            )
+            # La 2ème page est extraite par lots dans un pool de processus
+            extractions = payslip_pdf.extract_pages(pdf_downloads, context.extraction_pool,
+                                                    max_pending_bytes=PDF_MEMORY_BUDGET // 2)
+            for job, status_code, pdf_content, extraction in extractions:
+                task.raise_if_cancelled()
+
+                if status_code == 200:
+                    observe_extraction(metrics, pdf_content, extraction)
+                    extracted_content = report_extraction(task, extraction)
+                    if cache:
+                        cache.put(job["collaborator_id"], job["contract_id"], job["payslip_id"],
+                                  pdf=pdf_content, page=extracted_content,
+                                  single_page=payslip_pdf.is_single_page(extraction))
+                    if extracted_content:
+                        store_page(job, extracted_content)
+                        task.log.append(f"{job['full_name']} → ✅ 2ème page extraite et prête pour téléchargement")
+                        continue
+                    task.log.append(f"{job['full_name']} → ⚠️ Impossible d'extraire la 2ème page")
+                else:
+                    task.log.append(f"{job['full_name']} → ❌ Erreur lors du téléchargement du bulletin de paie (code {status_code})")
+                with store_lock:
+                    progress["done"] += 1
+                    update_progress()
+            if progress["cached"]:
+                task.log.append(f"♻️ {progress['cached']} bulletin(s) repris du cache")
+            with metrics.timer("archive"):
+                archive.finish()
+            zip_content = archive.read() if extracted_pages else None
+        finally:
+            close_stages(extractions, pdf_downloads)
+            archive.close()
+
+        # Les bulletins sont rangés dans l'ordre des collaborateurs, quel que soit l'ordre d'arrivée
+        exported_jobs = []
+        for job in payslip_jobs:
+            extracted_content = extracted_pages.pop(job["index"], None)
+            if extracted_content:
+                payslip_data[job["full_name"]] = {
+                    "file_name": job["file_name"],
+                    "content": extracted_content
+                }
+                exported_jobs.append(job)
+        if incremental:
+            task.add_message("info", f"♻️ Mode incrémental : {progress['already_exported']} bulletin(s) "
+                                     f"déjà exporté(s) ignoré(s), {len(payslip_data)} nouveau(x)")
+
+        result = {
+            "company_id": company_id,
+            "company_info": company_info,
+            "collabs": collabs,
+            "collabs_with_payslip": collabs_with_payslip,
+            "collabs_without_payslip": collabs_without_payslip,
+            "payslip_data": payslip_data,
+            "already_exported": progress["already_exported"],
+            "target_year": target_year,
+            "target_month": target_month,
+            "zip_content": zip_content,
+            "zip_stats": archive.stats if zip_content else None,
+            "policy": archive.policy,
+            "metrics": metrics,
+            "exported_jobs": exported_jobs,
+        }
+        metrics.finish()
+
+        task.set_progress(100)
+        task.set_status("success", "✅ Traitement terminé!")
+        return result
@@ -0,0 +1,34 @@
+"""Journal de traitement borné, sans dépendance à Streamlit"""
+import threading
+from collections import deque
+
+# Lignes gardées : au-delà, les plus anciennes sont oubliées
+DEFAULT_LOG_MAX_LINES = 500
+
+class ProcessingLog:
+    """Journal à taille fixe, écrit par la tâche et relu par l'interface.
+
+    Ajouter une ligne coûte O(1) et text() renvoie au plus max_lines lignes.
+    L'interface relit le journal à son propre rythme (JOB_POLL_INTERVAL, index.py) :
+    c'est ce délai, et non le nombre de lignes écrites, qui borne le coût
+    de l'affichage.
+    """
+
+    def __init__(self, max_lines=DEFAULT_LOG_MAX_LINES):
+        self._lines = deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        self.dropped_lines = 0
+
+    def append(self, line=""):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self.dropped_lines += 1
+            self._lines.append(line)
+
+    def text(self):
+        with self._lock:
+            lines = list(self._lines)
+            dropped_lines = self.dropped_lines
+        if dropped_lines:
+            lines.insert(0, f"… {dropped_lines} ligne(s) plus ancienne(s) masquée(s)")
+        return "\n".join(lines)
@@ -0,0 +1,182 @@
+"""Stockage des résultats de récupération hors de la session, sans dépendance à Streamlit.
+
+Seules les métadonnées restent en mémoire : le contenu des PDF et des ZIP
+est ajouté à des fichiers temporaires, un par session et par type de
+résultat, puis relu au moment du téléchargement. Chaque session a un quota
+en octets ; les sessions inactives depuis plus de ttl secondes sont
+libérées avec leurs fichiers.
+"""
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_SESSION_QUOTA = 1024 * 1024 * 1024
+DEFAULT_SESSION_TTL = 2 * 60 * 60
+
+class ResultQuotaExceeded(Exception):
+    """Le contenu ferait dépasser le quota de la session"""
+
+class ResultExpired(Exception):
+    """Le résultat a été libéré (session expirée ou résultat remplacé)"""
+
+class StoredBody:
+    """Contenu écrit dans un segment de résultats ; read() le relit en entier.
+
+    read peut être passé tel quel à st.download_button : le contenu n'est
+    chargé qu'au clic.
+    """
+
+    __slots__ = ("_segment", "_offset", "size")
+
+    def __init__(self, segment, offset, size):
+        self._segment = segment
+        self._offset = offset
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def read(self):
+        return self._segment.read_at(self._offset, self.size)
+
+class ResultSegment:
+    """Fichier temporaire où sont ajoutés les contenus d'un résultat, supprimé à la fermeture"""
+
+    def __init__(self, session, directory=None):
+        self._session = session
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._lock = threading.Lock()
+        self._adopted = []  # Ressources fermées avec le segment
+        self.size = 0
+        self.closed = False
+
+    def put(self, content):
+        """Ajoute content au segment et renvoie son StoredBody"""
+        self._session.reserve(len(content))
+        with self._lock:
+            if self.closed:
+                self._session.release(len(content))
+                raise ResultExpired()
+            offset = self.size
+            self._file.seek(offset)
+            self._file.write(content)
+            self.size += len(content)
+        return StoredBody(self, offset, len(content))
+
+    def adopt(self, resource, size=0):
+        """Rattache au segment une ressource déjà sur disque (archive ZIP...) : elle compte
+        dans le quota pour size octets et sera fermée avec le segment"""
+        self._session.reserve(size)
+        with self._lock:
+            self._adopted.append(resource)
+            self.size += size
+
+    def read_at(self, offset, size):
+        with self._lock:
+            if self.closed:
+                raise ResultExpired()
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._file.close()
+            adopted, self._adopted = self._adopted, []
+        for resource in adopted:
+            resource.close()
+        self._session.release(self.size)
+
+class SessionResults:
+    """Segments d'une session, par type de résultat ("monthly", "yearly"...), sous un quota commun"""
+
+    def __init__(self, quota=DEFAULT_SESSION_QUOTA, directory=None):
+        self.quota = quota
+        self.directory = directory
+        self.used_bytes = 0
+        self.last_access = time.time()
+        self._segments = {}  # {type de résultat: ResultSegment}
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        with self._lock:
+            if self.used_bytes + size > self.quota:
+                raise ResultQuotaExceeded(
+                    f"Quota de stockage de la session dépassé ({self.quota / 1e6:.0f} Mo)"
+                )
+            self.used_bytes += size
+
+    def release(self, size):
+        with self._lock:
+            self.used_bytes -= size
+
+    def open(self, namespace):
+        """Nouveau segment pour ce type de résultat ; le précédent est libéré"""
+        self.discard(namespace)
+        segment = ResultSegment(self, self.directory)
+        with self._lock:
+            self._segments[namespace] = segment
+        return segment
+
+    def get(self, namespace):
+        with self._lock:
+            return self._segments.get(namespace)
+
+    def discard(self, namespace):
+        with self._lock:
+            segment = self._segments.pop(namespace, None)
+        if segment is not None:
+            segment.close()
+
+    def close(self):
+        with self._lock:
+            segments = list(self._segments.values())
+            self._segments.clear()
+        for segment in segments:
+            segment.close()
+
+class ResultStore:
+    """Résultats de toutes les sessions, indexés par identifiant de session.
+
+    session() est appelée à chaque exécution du script : elle marque la
+    session comme active et libère celles qui ne l'ont pas été depuis ttl
+    secondes.
+    """
+
+    def __init__(self, directory=None, session_quota=DEFAULT_SESSION_QUOTA, ttl=DEFAULT_SESSION_TTL):
+        self.directory = directory
+        self.session_quota = session_quota
+        self.ttl = ttl
+        self._sessions = {}  # {identifiant de session: SessionResults}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def session(self, session_id):
+        self._purge()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = SessionResults(self.session_quota, self.directory)
+            session.last_access = time.time()
+            return session
+
+    def _purge(self):
+        limit = time.time() - self.ttl
+        with self._lock:
+            expired = [session_id for session_id, session in self._sessions.items() if session.last_access < limit]
+            sessions = [self._sessions.pop(session_id) for session_id in expired]
+        for session in sessions:
+            session.close()
+
+def store_from_env():
+    """Crée le stockage à partir de RESULT_STORE_DIR (dossier temporaire du système
+    par défaut), RESULT_SESSION_QUOTA_BYTES et RESULT_SESSION_TTL_SECONDS."""
+    return ResultStore(
+        os.environ.get("RESULT_STORE_DIR") or None,
+        int(os.environ.get("RESULT_SESSION_QUOTA_BYTES") or DEFAULT_SESSION_QUOTA),
+        int(os.environ.get("RESULT_SESSION_TTL_SECONDS") or DEFAULT_SESSION_TTL),
+    )
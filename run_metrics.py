@@ -0,0 +1,166 @@
+"""Mesures par étape d'une récupération, sans dépendance à Streamlit.
+
+Chaque étape du pipeline (vérification de la clé, entreprise, liste des
+collaborateurs, listes de bulletins, cache, téléchargement, extraction,
+archive) cumule ses durées dans un histogramme, ses octets, ses nouvelles
+tentatives et ses erreurs. Le résultat s'exporte en JSON ou au format texte
+de Prometheus.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Bornes des histogrammes de durée, en secondes (celles des clients Prometheus)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Étapes dans l'ordre du pipeline, pour l'affichage
+STAGES = ("introspect", "company", "roster", "listings", "cache", "download", "extraction", "archive")
+
+METRIC_PREFIX = "payslip_export"
+
+class StageStats:
+    """Compteurs d'une étape ; buckets[i] compte les durées <= bornes[i], le dernier les autres"""
+
+    __slots__ = ("count", "seconds", "max_seconds", "buckets", "bytes", "retries", "errors")
+
+    def __init__(self, bucket_count):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (bucket_count + 1)
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+
+class RunMetrics:
+    """Mesures d'une récupération, alimentées depuis plusieurs threads"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.started_at = time.time()
+        self.wall_seconds = None
+        self._start = time.perf_counter()
+        self._stages = {}  # {étape: StageStats}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage):
+        stats = self._stages.get(stage)
+        if stats is None:
+            stats = self._stages[stage] = StageStats(len(self.bounds))
+        return stats
+
+    def observe(self, stage, seconds, nbytes=0, error=False):
+        """Enregistre une opération de l'étape : sa durée, ses octets, et si elle a échoué"""
+        index = next((i for i, bound in enumerate(self.bounds) if seconds <= bound), len(self.bounds))
+        with self._lock:
+            stats = self._stage(stage)
+            stats.count += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.buckets[index] += 1
+            stats.bytes += nbytes
+            if error:
+                stats.errors += 1
+
+    def add_bytes(self, stage, nbytes):
+        with self._lock:
+            self._stage(stage).bytes += nbytes
+
+    def add_retry(self, stage):
+        with self._lock:
+            self._stage(stage).retries += 1
+
+    @contextmanager
+    def timer(self, stage, nbytes=0):
+        """Mesure la durée du bloc ; une exception le compte comme une erreur"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(stage, time.perf_counter() - start, nbytes, error=True)
+            raise
+        self.observe(stage, time.perf_counter() - start, nbytes)
+
+    def finish(self):
+        """Fige la durée totale de la récupération"""
+        self.wall_seconds = time.perf_counter() - self._start
+
+    def quantile(self, stage, q):
+        """Estimation d'un quantile de durée à partir de l'histogramme (interpolation dans la classe)"""
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None or not stats.count:
+                return None
+            buckets, max_seconds, count = list(stats.buckets), stats.max_seconds, stats.count
+        rank = q * count
+        seen = 0
+        for i, bucket in enumerate(buckets):
+            if bucket and seen + bucket >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else max_seconds
+                return min(max_seconds, lower + (upper - lower) * (rank - seen) / bucket)
+            seen += bucket
+        return max_seconds
+
+    def to_dict(self):
+        """Mesures sous forme de dict sérialisable, étapes dans l'ordre du pipeline"""
+        with self._lock:
+            names = sorted(self._stages, key=lambda name: (STAGES.index(name) if name in STAGES else len(STAGES), name))
+            stages = {}
+            for name in names:
+                stats = self._stages[name]
+                stages[name] = {
+                    "count": stats.count,
+                    "seconds": stats.seconds,
+                    "max_seconds": stats.max_seconds,
+                    "bytes": stats.bytes,
+                    "retries": stats.retries,
+                    "errors": stats.errors,
+                    "buckets": dict(zip([*map(str, self.bounds), "+Inf"], stats.buckets)),
+                }
+        for name, stage in stages.items():
+            stage["p50_seconds"] = self.quantile(name, 0.5)
+            stage["p95_seconds"] = self.quantile(name, 0.95)
+        return {"started_at": self.started_at, "wall_seconds": self.wall_seconds, "stages": stages}
+
+    def to_json(self, **labels):
+        return json.dumps(dict(self.to_dict(), labels=labels), indent=2)
+
+    def to_prometheus(self, **labels):
+        """Format texte de Prometheus ; labels (mode, période...) est ajouté à chaque série"""
+        data = self.to_dict()
+
+        def series(name, value, **extra):
+            all_labels = dict(labels, **extra)
+            label_text = ",".join(f'{key}="{_escape(label_value)}"' for key, label_value in all_labels.items())
+            return f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}" if label_text else f"{METRIC_PREFIX}_{name} {value}"
+
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_duration_seconds Durée des opérations de chaque étape",
+            f"# TYPE {METRIC_PREFIX}_stage_duration_seconds histogram",
+        ]
+        for stage, stats in data["stages"].items():
+            cumulative = 0
+            for bound, bucket in stats["buckets"].items():
+                cumulative += bucket
+                lines.append(series("stage_duration_seconds_bucket", cumulative, stage=stage, le=bound))
+            lines.append(series("stage_duration_seconds_sum", repr(stats["seconds"]), stage=stage))
+            lines.append(series("stage_duration_seconds_count", stats["count"], stage=stage))
+        for name, key, help_text in (
+            ("stage_bytes_total", "bytes", "Octets reçus ou traités par étape"),
+            ("stage_retries_total", "retries", "Nouvelles tentatives par étape"),
+            ("stage_errors_total", "errors", "Erreurs par étape"),
+        ):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for stage, stats in data["stages"].items():
+                lines.append(series(name, stats[key], stage=stage))
+        if data["wall_seconds"] is not None:
+            lines.append(f"# HELP {METRIC_PREFIX}_run_duration_seconds Durée totale de la récupération")
+            lines.append(f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge")
+            lines.append(series("run_duration_seconds", repr(data["wall_seconds"])))
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,123 @@
+"""Profilage d'une récupération (cProfile et tracemalloc), sans dépendance à Streamlit.
+
+Réservé à l'administration : le profilage ralentit la récupération et
+tracemalloc suit les allocations de tout le processus, y compris celles
+des autres sessions. Un seul profilage tourne à la fois.
+
+cProfile ne suit que le thread de la tâche : le temps passé dans les
+threads de téléchargement et les processus d'extraction y apparaît comme
+de l'attente ; le détail par étape est dans les mesures de run_metrics.
+"""
+import cProfile
+import io
+import linecache
+import marshal
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Fonctions et lignes d'allocation gardées dans le rapport
+DEFAULT_TOP = 30
+# Profondeur des piles enregistrées par tracemalloc
+DEFAULT_TRACEMALLOC_FRAMES = 5
+# Allocations dont la pile complète est détaillée
+TRACEBACK_TOP = 3
+
+_profiling_lock = threading.Lock()
+
+class ProfilerBusy(Exception):
+    """Un autre profilage est déjà en cours dans le processus"""
+
+class RunProfile:
+    """Résultat d'un profilage : profil cProfile (format pstats) et rapport texte, étiquetés par tags"""
+
+    def __init__(self, tags, profile_data, functions_text, allocations_text, peak_bytes, seconds):
+        self.tags = tags
+        self.profile_data = profile_data  # Lisible par pstats.Stats ou snakeviz une fois écrit dans un fichier
+        self.functions_text = functions_text
+        self.allocations_text = allocations_text
+        self.peak_bytes = peak_bytes
+        self.seconds = seconds
+
+    @property
+    def file_stem(self):
+        """Nom de fichier reprenant les étiquettes : profil_mode-yearly_period-2024_collaborators-500"""
+        parts = [f"{key}-{value}".replace(" ", "_").replace("/", "-") for key, value in self.tags.items()]
+        return "_".join(["profil", *parts])
+
+    def text(self):
+        header = [f"{key} : {value}" for key, value in self.tags.items()]
+        header.append(f"Durée profilée : {self.seconds:.2f} s")
+        header.append(f"Pic de mémoire suivie par tracemalloc : {self.peak_bytes / 1e6:.1f} Mo")
+        return "\n".join([
+            *header, "",
+            "=== Fonctions (temps cumulé, thread de la tâche) ===", self.functions_text,
+            "=== Mémoire encore allouée en fin de récupération ===", self.allocations_text,
+        ])
+
+class RunProfiler:
+    """Contexte qui profile le bloc exécuté : with RunProfiler() as profiler: ... puis profiler.result(**tags)"""
+
+    def __init__(self, top=DEFAULT_TOP, frames=DEFAULT_TRACEMALLOC_FRAMES):
+        self.top = top
+        self.frames = frames
+        self._profiler = cProfile.Profile()
+        self._started_tracemalloc = False
+        self._snapshot = None
+        self._peak_bytes = 0
+        self._seconds = 0.0
+
+    def __enter__(self):
+        if not _profiling_lock.acquire(blocking=False):
+            raise ProfilerBusy("Un profilage est déjà en cours")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._start = time.perf_counter()
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profiler.disable()
+        try:
+            self._seconds = time.perf_counter() - self._start
+            self._peak_bytes = tracemalloc.get_traced_memory()[1]
+            self._snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ])
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            _profiling_lock.release()
+
+    def _functions_text(self):
+        output = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=output)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(self.top)
+        return output.getvalue()
+
+    def _allocations_text(self):
+        lines = []
+        for stat in self._snapshot.statistics("lineno")[:self.top]:
+            frame = stat.traceback[0]
+            source = linecache.getline(frame.filename, frame.lineno).strip()
+            lines.append(f"{stat.size / 1e6:9.2f} Mo {stat.count:8d} bloc(s)  {frame.filename}:{frame.lineno}  {source}")
+        for stat in self._snapshot.statistics("traceback")[:TRACEBACK_TOP]:
+            lines.append("")
+            lines.append(f"{stat.size / 1e6:.2f} Mo alloués depuis :")
+            lines.extend(f"  {line}" for line in stat.traceback.format())
+        return "\n".join(lines) + "\n"
+
+    def result(self, **tags):
+        """RunProfile du bloc profilé (à appeler après sa sortie)"""
+        profile_stats = pstats.Stats(self._profiler)
+        profile = RunProfile(
+            tags, marshal.dumps(profile_stats.stats), self._functions_text(), self._allocations_text(),
+            self._peak_bytes, self._seconds
+        )
+        self._snapshot = None  # Les traces de tout le processus ne sont plus utiles
+        return profile
@@ -0,0 +1,92 @@
+"""Poignée sur un secret (clé API) qui suit ses copies, sans dépendance à Streamlit.
+
+La clé est gardée dans un bytearray, remis à zéro par wipe(). Les objets
+qui ont besoin d'une copie en clair (le client HTTP, pour son en-tête
+Authorization) l'obtiennent par reveal() et s'enregistrent avec attach() :
+wipe() leur demande d'oublier leur copie. `resident` dit en temps
+constant si la clé est encore en mémoire, sans parcourir le tas.
+
+Les chaînes Python ne peuvent pas être effacées : une copie rendue par
+reveal() reste en mémoire jusqu'à ce que son détenteur la libère. La
+poignée en limite le nombre et sait lesquelles sont encore détenues.
+"""
+import hashlib
+import threading
+import weakref
+from contextlib import contextmanager
+
+class SecretWiped(Exception):
+    """Le secret a été effacé : il faut le saisir à nouveau"""
+
+class SecretHandle:
+    """Clé secrète effaçable ; str() et repr() ne l'affichent jamais.
+
+    Les détenteurs enregistrés par attach() doivent avoir une méthode
+    wipe_secret() qui supprime leur copie ; ils ne sont référencés que
+    faiblement.
+    """
+
+    def __init__(self, value):
+        self._buffer = bytearray(value.encode())
+        self.fingerprint = hashlib.sha256(self._buffer).hexdigest()  # Pour les caches indexés par clé
+        self._holders = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "SecretHandle(effacé)" if self.wiped else "SecretHandle(****)"
+
+    __str__ = __repr__
+
+    def __bool__(self):
+        return bool(self._buffer)
+
+    @property
+    def wiped(self):
+        return self._buffer is None
+
+    @property
+    def copies(self):
+        """Détenteurs d'une copie en clair encore vivants"""
+        return len(self._holders)
+
+    @property
+    def resident(self):
+        """True tant que la clé ou une de ses copies est en mémoire"""
+        return self._buffer is not None or len(self._holders) > 0
+
+    def reveal(self):
+        """Copie en clair de la clé, pour un appel qui l'exige (à ne pas garder sans attach)"""
+        with self._lock:
+            if self._buffer is None:
+                raise SecretWiped("Clé API effacée")
+            return self._buffer.decode()
+
+    def attach(self, holder):
+        with self._lock:
+            if self._buffer is None:
+                raise SecretWiped("Clé API effacée")
+            self._holders.add(holder)
+
+    def detach(self, holder):
+        with self._lock:
+            self._holders.discard(holder)
+
+    def wipe(self):
+        """Remet la clé à zéro et demande aux détenteurs d'oublier leur copie"""
+        with self._lock:
+            if self._buffer is not None:
+                self._buffer[:] = bytes(len(self._buffer))
+                self._buffer = None
+            holders = list(self._holders)
+            self._holders.clear()
+        for holder in holders:
+            holder.wipe_secret()
+
+@contextmanager
+def wiped_after(secret):
+    """Efface secret à la sortie du bloc s'il s'agit d'une SecretHandle ; une chaîne est laissée telle quelle"""
+    try:
+        yield
+    finally:
+        if isinstance(secret, SecretHandle):
+            secret.wipe()
@@ -0,0 +1,76 @@
+"""Manifeste des bulletins déjà exportés, pour les récupérations incrémentales.
+
+Chaque bulletin exporté est enregistré par (entreprise, payslipId) avec
+une empreinte de son entrée dans la liste Payfit : une récupération
+incrémentale ignore les bulletins déjà exportés dont l'empreinte n'a pas
+changé, et ne télécharge que les nouveaux ou ceux qui ont été réémis.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exported_payslips (
+    company_id TEXT NOT NULL,
+    payslip_id TEXT NOT NULL,
+    collaborator_id TEXT NOT NULL,
+    contract_id TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    exported_at REAL NOT NULL,
+    PRIMARY KEY (company_id, payslip_id)
+)
+"""
+
+def payslip_fingerprint(payslip):
+    """Empreinte d'une entrée de la liste des bulletins : change si Payfit la réémet"""
+    return hashlib.sha256(json.dumps(payslip, sort_keys=True, default=str).encode()).hexdigest()
+
+class SyncManifest:
+    """Manifeste SQLite partagé par les tâches (une connexion, protégée par un verrou)"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(SCHEMA)
+
+    def exported_fingerprints(self, company_id):
+        """{payslip_id: empreinte} des bulletins déjà exportés pour l'entreprise"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT payslip_id, fingerprint FROM exported_payslips WHERE company_id = ?", (str(company_id),)
+            ).fetchall()
+        return dict(rows)
+
+    def record(self, company_id, entries):
+        """Enregistre des bulletins exportés : dicts avec payslip_id, collaborator_id, contract_id,
+        year, month et fingerprint (les jobs du pipeline)"""
+        now = time.time()
+        rows = [
+            (str(company_id), str(entry["payslip_id"]), str(entry["collaborator_id"]), str(entry["contract_id"]),
+             int(entry["year"]), int(entry["month"]), entry["fingerprint"], now)
+            for entry in entries
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO exported_payslips VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def manifest_from_env():
+    """Crée le manifeste à partir de SYNC_MANIFEST_PATH ; renvoie None s'il n'est pas configuré"""
+    path = os.environ.get("SYNC_MANIFEST_PATH")
+    if not path:
+        return None
+    return SyncManifest(path)